@@ -5,48 +5,35 @@ to that described at http://fitnesse.org/FitNesse.UserGuide.SliM.CustomTypes.
 Import this module and use the method decorators 
     convert_arg(to_type=...) 
     convert_arg(using=...)
+    convert_arg() - converting args to the types they are annotated with
     convert_result(using=...) 
 in your own classes (see decision_table and script_table in the examples).
+Conversions to immutable types can be memoized with memoize_converters().
 
 Converters are provided for bool, int, float and datetime (date, time 
-and datetime), list, tuple and dict types. You can obtain the appropriate
+and datetime), list, tuple (and other sequences, such as the lazy views of 
+nested table arguments) and dict types, and for Table: a columnar view of 
+a table argument that converts columns in bulk. You can obtain the appropriate
 converter using the converter_for() function or just make use of it for
 stringification with the to_string() function. You can register a custom 
 converter with this module using register_converter(), after which it will 
 be accessible both to decorated methods and to the waferslim code that 
 translates return values into standard slim strings.
 
+Converters are registered process-wide, unless an ExecutionContext that 
+isolates imports (see keepalive startup arg) is executing: then they are
+registered only for that context, in an overlay of the process-wide ones.
+Modules that such a context imports as normal (shared or installed modules,
+and waferslim's own) are only imported once, so they register process-wide.
+
 The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved 
 '''
-import datetime, threading, html.parser
+import collections, collections.abc, contextvars, datetime, functools
+import inspect, threading, typing, weakref, html.parser
 from waferslim import WaferSlimException
 
-__THREADLOCAL = threading.local()
-
-class _ReIterable:
-    ''' Class to allow repeatable iteration over to_type / using converters ''' 
-    def __init__(self, underlying):
-        ''' Specify the iterable for repeatable iteration '''
-        self._underlying = underlying
-    def reset(self, num_params):
-        ''' Reset iteration and note num_params supplied in method call '''
-        self._num_params = num_params
-        try:
-            self._iterator = iter(self._underlying)
-        except TypeError:
-            self._iterator = None
-        return True
-    def next(self):
-        ''' Get next value from the iterable '''
-        try:
-            return self._iterator and next(self._iterator) or self._underlying
-        except StopIteration:
-            msg = '%s to_type or using args insufficient to convert %s params'
-            raise WaferSlimException(msg % (len(self._underlying), 
-                                            self._num_params))
-            
 class TableTableConstants:
     ''' String constants for returning results from a TableTable '''
     @classmethod
@@ -87,6 +74,12 @@ class Converter:
         ''' NotImplemented! '''
         msg = 'from_string(%s) must be implemented in subclasses' % value
         raise NotImplementedError(msg)
+    
+    def from_strings(self, values):
+        ''' Convert a whole sequence of values (e.g. a table column) at once.
+        Subclasses may override this with a faster bulk conversion. '''
+        from_string = self.from_string
+        return [from_string(value) for value in values]
 
 # Default when no type-specific instance is present
 _DEFAULT_CONVERTER = Converter()   
@@ -133,52 +126,137 @@ class FromConstructorConverter(Converter):
         ''' Delegate to the type(str) constructor to perform the conversion '''
         return self._type(value)
     
-class DateConverter(Converter):
+    def from_strings(self, values):
+        ''' Delegate to the type(str) constructor for each of the values '''
+        return list(map(self._type, values))
+    
+    def to_string(self, value):
+        ''' Use str() of a value of the type. A value of a subclass (e.g. an
+        IntEnum value, whose str() is its name before python 3.11) is first 
+        converted to the type itself. '''
+        if type(value) is not self._type and isinstance(value, self._type):
+            value = self._type(value)
+        return str(value)
+    
+class _IsoFormatConverter(Converter):
+    ''' Base class for converters to/from datetime types via iso-standard 
+    formats. Values are parsed with the fromisoformat() of the type (which 
+    is fast, and allows a time-zone UTC offset) and only parsed with 
+    strptime() and the formats of the subclass if that fails. '''
+    
+    def from_string(self, value):
+        ''' Generate a value of the type from an iso-standard format str '''
+        try:
+            return self._from_isoformat(value)
+        except ValueError:
+            return self._from_strptime(value)
+    
+    def from_strings(self, values):
+        ''' Generate values of the type from iso-standard format strs '''
+        try:
+            return list(map(self._from_isoformat, values))
+        except ValueError:
+            return [self.from_string(value) for value in values]
+        
+    def to_string(self, value):
+        ''' Generate an iso-standard format str from a value '''
+        return value.isoformat()
+    
+    def _from_strptime(self, value):
+        ''' Generate a datetime.datetime from a str in one of the formats of
+        the subclass, or else raise a ValueError '''
+        for strptime_format in self._formats[:-1]:
+            try:
+                return datetime.datetime.strptime(value, strptime_format)
+            except ValueError:
+                pass
+        return datetime.datetime.strptime(value, self._formats[-1])
+    
+class DateConverter(_IsoFormatConverter):
     ''' Converter to/from datetime.date type via iso-standard format 
     (4digityear-2digitmonth-2digitday, e.g. 2009-02-28) '''
     
     DATE_FORMAT = '%Y-%m-%d'
     
-    def from_string(self, value):
+    _from_isoformat = datetime.date.fromisoformat
+    _formats = (DATE_FORMAT,)
+    
+    def _from_strptime(self, value):
         ''' Generate datetime.date from iso-standard format str '''
-        return datetime.datetime.strptime(value, 
-                                          DateConverter.DATE_FORMAT).date()
+        return super()._from_strptime(value).date()
 
-class TimeConverter(Converter):
-    ''' Converter to/from datetime.date type via iso-standard format 
+class TimeConverter(_IsoFormatConverter):
+    ''' Converter to/from datetime.time type via iso-standard format 
     (2digithour:2digitminute:2digitsecond - with or without
-    an additional optional .6digitmillis, e.g. 01:02:03 or 01:02:03.456789).
-    Does not take any time-zone UTC offset into account!'''
+    an additional optional .6digitmillis, e.g. 01:02:03 or 01:02:03.456789,
+    and an optional time-zone UTC offset e.g. 01:02:03+01:00).'''
     
     TIME_FORMAT_WITHOUT_MICROSECONDS = '%H:%M:%S'
     TIME_FORMAT_WITH_MICROSECONDS = TIME_FORMAT_WITHOUT_MICROSECONDS + '.%f'
     
-    def from_string(self, value):
+    _from_isoformat = datetime.time.fromisoformat
+    _formats = (TIME_FORMAT_WITH_MICROSECONDS, 
+                TIME_FORMAT_WITHOUT_MICROSECONDS)
+    
+    def _from_strptime(self, value):
         ''' Generate datetime.time from formatted str '''
-        try:
-            return datetime.datetime.strptime(value, 
-                TimeConverter.TIME_FORMAT_WITH_MICROSECONDS).time()
-        except ValueError:
-            return datetime.datetime.strptime(value, 
-                TimeConverter.TIME_FORMAT_WITHOUT_MICROSECONDS).time()
+        return super()._from_strptime(value).time()
     
-class DatetimeConverter(Converter):
+class DatetimeConverter(_IsoFormatConverter):
     ''' Converter to/from datetime.datetime type via iso-standard formats 
-    ("dateformat<space>timeformat", e.g. "2009-02-28 21:54:32.987654"). '''
+    ("dateformat<space>timeformat", e.g. "2009-02-28 21:54:32.987654",
+    with an optional time-zone UTC offset). '''
 
     FORMAT_WITH_MICROSECONDS = '%s %s' % (DateConverter.DATE_FORMAT, 
                                 TimeConverter.TIME_FORMAT_WITH_MICROSECONDS)
     FORMAT_WITHOUT_MICROSECONDS = '%s %s' % (DateConverter.DATE_FORMAT, 
                                 TimeConverter.TIME_FORMAT_WITHOUT_MICROSECONDS)
+    
+    _from_isoformat = datetime.datetime.fromisoformat
+    _formats = (FORMAT_WITH_MICROSECONDS, FORMAT_WITHOUT_MICROSECONDS)
+    
+    def to_string(self, value):
+        ''' Generate a "dateformat<space>timeformat" str from a value '''
+        return value.isoformat(' ')
 
+class MemoizingConverter(Converter):
+    ''' Converter that remembers the values converted from the most recently
+    used maxsize strs by another converter, so that e.g. decision table cells
+    that repeat the same str are only converted once. Only suitable for 
+    converters that produce values of immutable types, since the same value 
+    is returned for every occurrence of a str. See memoize_converters(). '''
+    
+    def __init__(self, converter, maxsize=1024):
+        ''' Specify the converter to memoize, and how many strs to remember '''
+        super().__init__()
+        self.converter = converter
+        self._cached_from_string = functools.lru_cache(maxsize)(
+                                                    converter.from_string)
+        
+    def to_string(self, value):
+        ''' Delegate to the memoized converter '''
+        return self.converter.to_string(value)
+    
     def from_string(self, value):
-        ''' Generate a datetime.datetime from a str '''
-        try:
-            return datetime.datetime.strptime(value, 
-                                DatetimeConverter.FORMAT_WITH_MICROSECONDS) 
-        except ValueError:
-            return datetime.datetime.strptime(value, 
-                                DatetimeConverter.FORMAT_WITHOUT_MICROSECONDS) 
+        ''' Return the remembered conversion of a str value, converting it 
+        (and remembering it) if necessary '''
+        if isinstance(value, str):
+            return self._cached_from_string(value)
+        return self.converter.from_string(value)
+    
+    def from_strings(self, values):
+        ''' Remembered conversions of each of the values '''
+        from_string = self.from_string
+        return [from_string(value) for value in values]
+    
+    def cache_info(self):
+        ''' Return (hits, misses, maxsize, currsize) - see functools.lru_cache
+        - to show how effective the memoization is '''
+        return self._cached_from_string.cache_info()
+    
+    def cache_clear(self):
+        ''' Forget all remembered conversions, and reset the cache_info() '''
+        self._cached_from_string.cache_clear()
 
 class IterableConverter(Converter):
     ''' Converter to/from an iterable type (e.g. list, tuple). 
@@ -199,7 +277,7 @@ class IterableConverter(Converter):
             converters = _converters_for(to_type)
         else:
             converters = _strict_converter_for(to_type)
-        self._converters = _ReIterable(converters)
+        self._plan = _conversion_plan(converters)
     
     def to_string(self, iterable_values):
         ''' Generate a list of str values from a list of typed values.
@@ -217,13 +295,8 @@ class IterableConverter(Converter):
         for more details. '''
         if value.startswith('[') and value.endswith(']'):
             return self.from_string(value[1:len(value)-1])
-        items = value.split(',')
-        self._converters.reset(len(items))
-        return tuple([self._convert(item.strip()) for item in items])
-    
-    def _convert(self, item):
-        ''' Perform the actual conversion of an item '''
-        return self._converters.next().from_string(item)
+        items = [item.strip() for item in value.split(',')]
+        return tuple(_apply_plan(self._plan, items))
 
 class _MarkupHashTableParser(html.parser.HTMLParser):
     ''' Subclass HTMLParser to extract name-value pairs from an html table ''' 
@@ -302,6 +375,113 @@ class DictConverter(Converter):
                 a_dict[key] = from_string(a_dict[key], to_type_or_using)
         return a_dict
         
+class Table:
+    ''' Columnar view of a table argument, e.g. the rows passed to do_table()
+    in a table-table, or to table() in a decision table. Rows are iterated 
+    over without copying; columns can be accessed by header name (or index),
+    and are converted with the registered converters in one bulk pass per 
+    column, e.g.
+        @convert_arg(to_type=Table)
+        def table(self, table):
+            for cash in table.column('cash in wallet', to_type=int): ...
+    A Table without a header row can be obtained via 
+        @convert_arg(using=TableConverter(header_row=False)) '''
+    
+    def __init__(self, rows, header_row=True):
+        ''' Specify the rows (a sequence of sequences of str) and whether
+        the first of these is a header row containing column names '''
+        self._rows = rows
+        self._first = header_row and len(rows) and 1 or 0
+        self._header = self._first and tuple(rows[0]) or ()
+        self._column_indexes = {}
+        for index, name in enumerate(self._header):
+            self._column_indexes.setdefault(name, index)
+        self._columns = {}
+        
+    def header(self):
+        ''' Return the column names from the header row '''
+        return self._header
+    
+    def rows(self):
+        ''' Return the underlying rows, including any header row '''
+        return self._rows
+    
+    def __len__(self):
+        ''' Number of rows, excluding any header row '''
+        return len(self._rows) - self._first
+    
+    def __getitem__(self, index):
+        ''' Return a row by position (excluding any header row), or a list of
+        rows for a slice '''
+        if isinstance(index, slice):
+            rows, first = self._rows, self._first
+            return [rows[position + first] 
+                    for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Table row index out of range')
+        return self._rows[index + self._first]
+    
+    def __iter__(self):
+        ''' Iterate over the rows, excluding any header row '''
+        rows = self._rows
+        for index in range(self._first, len(rows)):
+            yield rows[index]
+    
+    def column_index(self, name_or_index):
+        ''' Return the position of a column given its header name '''
+        if isinstance(name_or_index, int):
+            return name_or_index
+        try:
+            return self._column_indexes[name_or_index]
+        except KeyError:
+            raise KeyError('No column %r in %r' % (name_or_index, 
+                                                   self._header))
+    
+    def column(self, name_or_index, to_type=None, using=None):
+        ''' Return the cells in a column (identified by header name or 
+        position) as a list, converted in one pass with a to_type or using 
+        converter if either is supplied. Converted columns are cached. 
+        Cells missing from short rows are None and are not converted. '''
+        index = self.column_index(name_or_index)
+        key = (index, to_type, using)
+        try:
+            return self._columns[key]
+        except (KeyError, TypeError):
+            pass
+        cells = [row[index] if len(row) > index else None for row in self]
+        if to_type is not None or using is not None:
+            present = [cell for cell in cells if cell is not None]
+            converted = iter(from_strings(present, using or to_type))
+            cells = [next(converted) if cell is not None else None \
+                     for cell in cells]
+        try:
+            self._columns[key] = cells
+        except TypeError:
+            pass
+        return cells
+
+class TableConverter(Converter):
+    ''' Converter from a table argument (a sequence of rows) to a Table. 
+    Note the slightly misleading name of from_string(): the value it is 
+    given is actually a sequence of rows rather than an actual str...'''
+    
+    def __init__(self, header_row=True):
+        ''' Specify whether tables have a header row of column names '''
+        super().__init__()
+        self._header_row = header_row
+        
+    def from_string(self, rows):
+        ''' Generate a Table from a sequence of rows '''
+        if isinstance(rows, Table):
+            return rows
+        return Table(rows, self._header_row)
+    
+    def to_string(self, table):
+        ''' Generate a list of rows, each a list of str values '''
+        return [[to_string(cell) for cell in row] for row in table.rows()]
+
 def register_converter(for_type, converter_instance):
     ''' Register a converter_instance to be used with all for_type instances.
     Registration is 'forever' (across all fitnesse tables run as a suite): the
@@ -310,22 +490,80 @@ def register_converter(for_type, converter_instance):
     A converter_instance must implement from_string() and to_string(). '''
     if hasattr(converter_instance, 'from_string') and \
     hasattr(converter_instance, 'to_string'):
-        __init_converters()
-        __THREADLOCAL.converters[for_type] = converter_instance
+        _registry().register(for_type, converter_instance)
         return
     msg = 'Converter for %s requires from_string() and to_string()' % for_type
     raise TypeError(msg)
 
-def __init_converters():
-    ''' Ensure standard converters exist for bool, int, float, datetime, ...
-    All registered converters, keyed on type, are held as thread-local to 
-    ensure that ExecutionContext-s (which are created per thread by the 
-    server) really are isolated from each other when the server is run 
-    in keepalive (multi-user) mode'''
-    if hasattr(__THREADLOCAL, 'converters'):
-        return
+class _Registry:
+    ''' Registered converters, keyed on type, optionally overlaying the 
+    converters registered in a base _Registry. Converters registered in an 
+    overlay are only seen through it, but those registered in its base at 
+    any time are seen through it too (unless overlaid).
+    Also holds a cache of the converter to use for values of each type: a 
+    value is converted by the converter registered for the nearest type in 
+    the MRO of its type (in the manner of functools.singledispatch) - so 
+    e.g. an IntEnum value is converted as an int. The cache is invalidated 
+    whenever a converter is registered, here or in the base - when the 
+    generation (a count of registrations in any _Registry) changes too. '''
+    generation = 0
+    _generation_lock = threading.Lock()
+    
+    def __init__(self, base=None):
+        ''' Start with no converters of its own '''
+        self._base = base
+        self._converters = {}
+        self._dispatch = {}
+        self._base_version = None
+        self._lock = threading.Lock()
+        self.version = 0
+        
+    def register(self, for_type, converter):
+        ''' Register a converter for a type '''
+        with self._lock:
+            self._converters[for_type] = converter
+            self._dispatch = {}
+            self.version += 1
+        with _Registry._generation_lock:
+            _Registry.generation += 1
     
-    __THREADLOCAL.converters = {} 
+    def lookup(self, for_type):
+        ''' Return the converter registered for exactly a type, or raise a
+        KeyError '''
+        try:
+            return self._converters[for_type]
+        except KeyError:
+            if self._base is None:
+                raise
+            return self._base.lookup(for_type)
+        
+    def for_value_type(self, value_type):
+        ''' Return the converter for values of a type '''
+        dispatch = self._dispatch
+        if self._base is not None \
+        and self._base_version != self._base.version:
+            dispatch = self._dispatch = {}
+            self._base_version = self._base.version
+        try:
+            return dispatch[value_type]
+        except KeyError:
+            pass
+        converter = _DEFAULT_CONVERTER
+        for base_type in value_type.__mro__:
+            try:
+                converter = self.lookup(base_type)
+                break
+            except KeyError:
+                pass
+        dispatch[value_type] = converter
+        return converter
+
+_REGISTRY = _Registry()
+_ACTIVE_REGISTRY = contextvars.ContextVar('converters', default=_REGISTRY)
+
+def __init_converters():
+    ''' Register standard converters for bool, int, float, datetime, ...
+    process-wide, once only '''
     register_converter(bool, TrueFalseConverter())
     register_converter(int, FromConstructorConverter(int))
     register_converter(float, FromConstructorConverter(float))
@@ -334,13 +572,158 @@ def __init_converters():
     register_converter(datetime.datetime, DatetimeConverter())
     register_converter(list, IterableConverter())
     register_converter(tuple, IterableConverter())
+    # e.g. protocol.Chunk - but not a sequence of characters
+    register_converter(collections.abc.Sequence, IterableConverter())
+    register_converter(collections.UserString, Converter())
     register_converter(str, StrConverter())
     register_converter(dict, DictConverter())
+    register_converter(Table, TableConverter())
+
+_registry = _ACTIVE_REGISTRY.get
+
+_IMMUTABLE_TYPES = (bool, int, float, 
+                    datetime.date, datetime.time, datetime.datetime)
+
+def memoize_converters(maxsize=1024, for_types=_IMMUTABLE_TYPES):
+    ''' Replace the converters in use (see registered_converters) for each 
+    of for_types (default: the standard immutable types) with a 
+    MemoizingConverter that remembers up to maxsize conversions. Return a 
+    dict of the MemoizingConverter-s, keyed on type, whose cache_info() can 
+    be used to tune maxsize. '''
+    memoizing_converters = {}
+    for for_type in for_types:
+        converter = _strict_converter_for(for_type)
+        if not isinstance(converter, MemoizingConverter):
+            converter = MemoizingConverter(converter, maxsize)
+            _registry().register(for_type, converter)
+        memoizing_converters[for_type] = converter
+    return memoizing_converters
+
+
+def registered_converters():
+    ''' Return the converters in use: those registered process-wide, unless 
+    others are in use (see use_registered_converters) '''
+    return _ACTIVE_REGISTRY.get()
+
+def isolated_converters():
+    ''' Return new converters, in which registrations are only seen by 
+    whatever uses them (see use_registered_converters), that otherwise 
+    has all the converters registered process-wide '''
+    return _Registry(_REGISTRY)
+
+def process_converters():
+    ''' Return the converters registered process-wide, which any others 
+    (see isolated_converters) overlay '''
+    return _REGISTRY
+
+def use_registered_converters(converters):
+    ''' Use converters (see registered_converters, isolated_converters) in
+    the current contextvars context, e.g. while executing for an 
+    ExecutionContext. Returns a token to pass to stop_using_converters(). '''
+    return _ACTIVE_REGISTRY.set(converters)
+
+def stop_using_converters(token):
+    ''' Use whatever converters were in use before use_registered_converters()
+    returned token '''
+    _ACTIVE_REGISTRY.reset(token)
 
 def _converters_for(to_types):
     ''' Return a list of converters based on the target types in to_types '''
     return [_strict_converter_for(_type) for _type in to_types]
 
+def _conversion_plan(converters):
+    ''' Compile a converter, or a sequence of converters, into an immutable 
+    plan: a tuple of from_string fns for successive args, and the from_string
+    fn for any further args (None if there must be no further args) '''
+    if hasattr(converters, 'from_string'):
+        return (), converters.from_string
+    return tuple([converter.from_string for converter in converters]), None
+
+def _annotated_plan(base_fn):
+    ''' Compile a plan from the annotations of base_fn's params (after self):
+    those annotated with a registered type, or with a converter, are 
+    converted and any others are passed through unconverted '''
+    from_string_fns = []
+    rest = _unconverted
+    params = list(inspect.signature(base_fn).parameters.values())
+    hints = None
+    for param in params[1:]:
+        annotation = param.annotation
+        if isinstance(annotation, str):
+            if hints is None:
+                hints = typing.get_type_hints(inspect.unwrap(base_fn))
+            annotation = hints.get(param.name, annotation)
+        from_string_fn = _annotated_from_string(annotation)
+        if param.kind is param.VAR_POSITIONAL:
+            rest = from_string_fn
+            break
+        if param.kind not in (param.POSITIONAL_ONLY, 
+                              param.POSITIONAL_OR_KEYWORD):
+            break
+        from_string_fns.append(from_string_fn)
+    return tuple(from_string_fns), rest
+
+def _annotated_from_string(annotation):
+    ''' The from_string fn for a param annotation '''
+    if hasattr(annotation, 'from_string') and not isinstance(annotation, type):
+        return annotation.from_string
+    try:
+        return _strict_converter_for(annotation).from_string
+    except (KeyError, TypeError):
+        return _unconverted
+
+class _Plans:
+    ''' The conversion plans for a method, compiled by a compile_plan fn for
+    each of the converters the method is used with (see 
+    registered_converters) and compiled again whenever a converter is 
+    registered in them. The latest plan used is kept as a tuple of 
+    (converters, generation, plan): while the same converters are in use 
+    and none has been registered, it is the plan to use. '''
+    __slots__ = ('_compile_plan', '_plans', 'latest')
+    
+    def __init__(self, compile_plan):
+        ''' Specify the fn that compiles a plan with the converters in use '''
+        self._compile_plan = compile_plan
+        self._plans = weakref.WeakKeyDictionary()
+        self.latest = (None, None, None)
+    
+    def use(self, converters):
+        ''' Make the plan for converters the latest, compiling it if they 
+        have had a converter registered since it was last compiled '''
+        generation = converters.generation
+        try:
+            plan_generation, plan = self._plans[converters]
+        except KeyError:
+            plan_generation = None
+        if plan_generation != generation:
+            plan = self._compile_plan()
+            self._plans[converters] = (generation, plan)
+        latest = self.latest = (converters, generation, plan)
+        return latest
+
+def _unconverted(arg):
+    ''' from_string fn for an arg that is not to be converted '''
+    return arg
+
+def _apply_plan(plan, args):
+    ''' Convert args with a conversion plan (see _conversion_plan) '''
+    from_string_fns, rest = plan
+    num_converted = len(from_string_fns)
+    if not num_converted and rest is not None:
+        return [rest(arg) if isinstance(arg, str) else _convert(rest, arg)
+                for arg in args]
+    converted = [from_string_fn(arg) if isinstance(arg, str) 
+                    else _convert(from_string_fn, arg)
+                 for from_string_fn, arg in zip(from_string_fns, args)]
+    if len(args) > num_converted:
+        if rest is None:
+            msg = '%s to_type or using args insufficient to convert %s params'
+            raise WaferSlimException(msg % (num_converted, len(args)))
+        converted.extend([rest(arg) if isinstance(arg, str) 
+                            else _convert(rest, arg)
+                          for arg in args[num_converted:]])
+    return converted
+
 def convert_arg(to_type=None, using=None):
     ''' Method decorator to convert a slim-standard string arg to a specific
     python datatype. Only 1 of "to_type" or "using" should be supplied. 
@@ -359,27 +742,61 @@ def convert_arg(to_type=None, using=None):
     method, e.g. 
         @convert_arg(to_type=(int, float))
         def some_method(self, an_int, a_float)...
+    If neither is supplied then the conversion strategy is taken from the 
+    method's annotations (of registered types, or converters) when it is 
+    first called, e.g.
+        @convert_arg()
+        def some_method(self, an_int: int, a_table: Table, a_str)...
+    The converters are looked up when the method is decorated (or first 
+    called) and then only again if the converters in use are different, or
+    have had a converter registered in them (see registered_converters).
     '''
-    conversion_strategy = to_type and to_type or using
-    if not conversion_strategy:
-        raise TypeError('One of "to_type" or "using" must be supplied')
     def conversion_decorator(base_fn):
         ''' callable that performs the actual decoration '''
-        if type(conversion_strategy) is tuple:
-            converter = using and using or _converters_for(to_type)
+        if using:
+            plan = _conversion_plan(using)
+            compile_plan = lambda: plan
+        elif not to_type:
+            compile_plan = lambda: _annotated_plan(base_fn)
+        elif type(to_type) is tuple:
+            compile_plan = lambda: _conversion_plan(_converters_for(to_type))
         else:
-            converter = using and using or _strict_converter_for(to_type)
-        reiterable = _ReIterable(converter)
-        _reset = reiterable.reset
-        _next = reiterable.next
+            compile_plan = lambda: _conversion_plan(
+                                        _strict_converter_for(to_type))
+        plans = _Plans(compile_plan)
+        if using or to_type:
+            plans.use(_registry())
+        @functools.wraps(base_fn)
         def convert_args_and_return_result(self, *args):
             ''' callable that delegates to the decorated fn '''
-            _reset(len(args))
-            return base_fn(self, 
-                    *tuple([_next().from_string(arg) for arg in args]))
+            converters = _registry()
+            latest_converters, generation, plan = plans.latest
+            if latest_converters is not converters \
+            or generation != converters.generation:
+                plan = plans.use(converters)[2]
+            return base_fn(self, *_apply_plan(plan, args))
         return convert_args_and_return_result 
     return conversion_decorator
 
+def _convert(from_string_fn, arg):
+    ''' Convert an arg that is slim data (see _is_slim_data). Any other arg 
+    is already a python value (e.g. of a typed symbol - see ExecutionContext)
+    and is passed through unconverted. '''
+    if _is_slim_data(arg):
+        return from_string_fn(arg)
+    return arg
+
+def _is_slim_data(arg):
+    ''' Is an arg a str, or a (possibly lazy) nested table of them? '''
+    if isinstance(arg, str) or hasattr(arg, 'with_leaves'):
+        return True
+    if isinstance(arg, (list, tuple)):
+        for item in arg:
+            if not _is_slim_data(item):
+                return False
+        return True
+    return False
+
 def convert_result(using):
     ''' Method decorator to convert a method result from a python datatype 
     using a specific converter. The argument "using" is required.
@@ -392,17 +809,25 @@ def convert_result(using):
         raise TypeError('"using" converter must be supplied')
     def conversion_decorator(base_fn):
         ''' callable that performs the actual decoration '''
-        return lambda self, *args: using.to_string(base_fn(self, *args))
+        @functools.wraps(base_fn)
+        def convert_result_and_return_it(self, *args):
+            ''' callable that converts the result of the decorated fn '''
+            return using.to_string(base_fn(self, *args))
+        return convert_result_and_return_it
     return conversion_decorator
 
 def converter_for(type_or_value): 
     ''' Returns the appropriate converter for a particular type_or_value.
-    This will be a registered type-specific converter if one exists,
-    otherwise the default (base Converter).''' 
-    try:
-        return _strict_converter_for(type_or_value)
-    except KeyError:
-        return _DEFAULT_CONVERTER
+    For a type, this will be a converter registered for exactly that type if
+    one exists. For a value, it will be a converter registered for its type
+    or the nearest of its base types. Otherwise it will be the default 
+    (base Converter).''' 
+    if isinstance(type_or_value, type):
+        try:
+            return _strict_converter_for(type_or_value)
+        except KeyError:
+            return _DEFAULT_CONVERTER
+    return _registry().for_value_type(type(type_or_value))
     
 def to_string(value, using=None):
     ''' Shortcut for converter_for(value).to_string(value) or 
@@ -413,7 +838,7 @@ def to_string(value, using=None):
     ''' 
     if using and hasattr(using, 'to_string'):
         return using.to_string(value)
-    return converter_for(value).to_string(value)
+    return _registry().for_value_type(type(value)).to_string(value)
     
 def from_string(value, to_type_or_using):
     ''' Shortcut for converter_for(to_type).from_string(value) or 
@@ -427,12 +852,25 @@ def from_string(value, to_type_or_using):
         return to_type_or_using.from_string(value)
     return converter_for(to_type_or_using).from_string(value)
     
+def from_strings(values, to_type_or_using):
+    ''' Bulk equivalent of from_string(): de-stringify a whole sequence of
+    values in one pass, with the converter's from_strings() if it has one. '''
+    if hasattr(to_type_or_using, 'from_string'):
+        converter = to_type_or_using
+    else:
+        converter = converter_for(to_type_or_using)
+    if hasattr(converter, 'from_strings'):
+        return list(converter.from_strings(values))
+    return [converter.from_string(value) for value in values]
+    
 def _strict_converter_for(type_or_value): 
     ''' Returns the exact converter for a particular type_or_value.
     This will be a registered type-specific converter if one exists,
     otherwise a KeyError will be raised.'''
-    __init_converters() 
+    registry = _registry()
     try:
-        return __THREADLOCAL.converters[type_or_value]
+        return registry.lookup(type_or_value)
     except (KeyError, TypeError):
-        return __THREADLOCAL.converters[type(type_or_value)]
\ No newline at end of file
+        return registry.lookup(type(type_or_value))
+
+__init_converters()
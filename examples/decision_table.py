@@ -28,11 +28,23 @@ Fitnesse table markup:
 |      0       |    yes    |      1                |    no      |
 |      10      |    yes    |      1                |    nope    |
 
+|should I buy milk in rows|
+|cash in wallet|credit card|pints of milk remaining|go to store?|
+|      0       |    no     |      0                |    no      |
+|      10      |    no     |      0                |    yes     |
+|      0       |    yes    |      0                |    yes     |
+|      10      |    yes    |      0                |    yes     |
+|      0       |    no     |      1                |    no      |
+|      10      |    no     |      1                |    no      |
+|      0       |    yes    |      1                |    no      |
+|      10      |    yes    |      1                |    nope    |
+
 This test will pass apart from the last row in each table 
 whose "nope" values will be red.
 '''
 
 from waferslim.converters import convert_arg, convert_result, YesNoConverter
+from waferslim.execution import pythonic
 
 # Most conversion can be handled using the standard registered converters
 # but we're using (for better table readability) the bool YesNoConverter 
@@ -103,3 +115,22 @@ class ShouldIBuyMilkAlternativeImplementation(ShouldIBuyMilk):
         ''' Slim-standard method that will be invoked before each table row, 
         if it is present ''' 
         self._go_to_store = False
+
+class ShouldIBuyMilkInRows(ShouldIBuyMilk):
+    ''' Alternative implementation of ShouldIBuyMilk to illustrate use of 
+    an execute_rows() method, which is given all the rows of the table at 
+    once instead of each call in each row being made separately. '''
+    
+    def execute_rows(self, rows):
+        ''' Each row is a list of (method name, args) calls -- the setters,
+        "reset" and "execute" (if they are present), and getters -- and a 
+        list of results, one for each call, is returned for each row.
+        Here, the calls are simply made in turn. '''
+        results = []
+        for row in rows:
+            row_results = []
+            for name, args in row:
+                method = getattr(self, pythonic(name), None)
+                row_results.append(method and method(*args))
+            results.append(row_results)
+        return results
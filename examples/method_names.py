@@ -23,7 +23,7 @@ All tests will pass...
 
 |script|class with camel case method names|
 
-"A Method", "a_method" and "AMethod" will fail...
+"a_method" will fail...
 
 |script|
 |invoke|a method|with|hello world|
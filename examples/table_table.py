@@ -24,8 +24,9 @@ class Bowling:
     
     def do_table(self, table_rows):
         ''' Standard entry point for Slim Table Table. 
-        table_rows is a tuple containing a tuple for each row in the 
-        fitnesse table (in this case 1 row for rolls and 1 row for scores)'''
+        table_rows is a sequence containing a sequence for each row in the 
+        fitnesse table (in this case 1 row for rolls and 1 row for scores).
+        The rows and cells are decoded lazily, as they are accessed.'''
         return self._score_game(table_rows[0], table_rows[1])
         
     def _score_game(self, rolls, expected_scores):
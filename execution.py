@@ -8,10 +8,16 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 Copyright 2009-2010 by the author(s). All rights reserved 
 '''
 import traceback
-import builtins, logging, re, sys, threading
+import asyncio, builtins, collections, concurrent.futures, contextvars
+import importlib, importlib.machinery, importlib.util
+import inspect, json, logging, operator, os, re, sys, sysconfig, threading
 from waferslim.instructions import Instruction, \
                                    Make, Call, CallAndAssign, Import
-from waferslim.converters import to_string
+from waferslim.converters import to_string, isolated_converters, \
+                                 process_converters, registered_converters, \
+                                 use_registered_converters, \
+                                 stop_using_converters
+from waferslim.logs import Abbreviated, RateLimiter, debug
 
 _OK = 'OK'
 _EXCEPTION = '__EXCEPTION__:'
@@ -19,37 +25,77 @@ _STOP_TEST = '%sABORT_SLIM_TEST:' % _EXCEPTION
 _NONE_STRING = '/__VOID__/'
 
 class Results:
-    ''' Collecting parameter for results of Instruction execute() methods '''
+    ''' Collecting parameter for results of Instruction execute() methods.
+    Each result is encoded into the protocol format, as a single str, as 
+    soon as it is collected; the strs are joined into one every so often, 
+    so that only a few compact strs are held until the response is sent. '''
     NO_RESULT_EXPECTED = object()
+    _JOIN_EVERY = 256
     
     def __init__(self, convert_to_string=to_string):
-        ''' Set up the list to hold the collected results and obtain the
+        ''' Set up the lists to hold the collected results and obtain the
         currently registered type converters '''
-        self._collected = []
+        # protocol imports this module, so it can't be imported at the top
+        from waferslim.protocol import pack_pair_item, pack_items, unpack
+        self._pack_pair_item = pack_pair_item
+        self._pack_items = pack_items
+        self._unpack = unpack
+        self._joined, self._packed = [], []
+        self._count = 0
         self._convert_to_string = convert_to_string
     
     def completed(self, instruction, result=NO_RESULT_EXPECTED):
         ''' An instruction has completed, perhaps with a result '''
-        if result == Results.NO_RESULT_EXPECTED:
+        if result is Results.NO_RESULT_EXPECTED:
             str_result = _OK
         elif result is None:
             str_result = _NONE_STRING
         else:
             str_result = self._convert_to_string(result)
-        self._collected.append([instruction.instruction_id(), str_result])
+        self._collect(self._pack_pair_item(instruction.instruction_id(), 
+                                           str_result))
         
     def failed(self, instruction, cause, stop_test=False):
         ''' An instruction has failed due to some underlying cause '''
         failed_type = stop_test and _STOP_TEST or _EXCEPTION
-        self._collected.append([instruction.instruction_id(),
-                                '%s message:<<%s>>' % (failed_type, cause)])
+        self._collect(self._pack_pair_item(
+            instruction.instruction_id(), 
+            '%s message:<<%s>>' % (failed_type, cause)))
+    
+    def _collect(self, packed_item):
+        ''' Hold a packed [instruction_id, str_result] item '''
+        packed = self._packed
+        packed.append(packed_item)
+        self._count += 1
+        if len(packed) == self._JOIN_EVERY:
+            self._join()
+    
+    def _join(self):
+        ''' Join the packed items held separately into one str '''
+        self._joined.append(''.join(self._packed))
+        self._packed.clear()
+    
+    def fork(self):
+        ''' Get new, empty results that are converted in the same way, to be
+        collected separately then merged (see merge) '''
+        return type(self)(self._convert_to_string)
+    
+    def merge(self, forked):
+        ''' Add all the results collected by forked results (see fork) '''
+        self._join()
+        self._joined.extend(forked._joined)
+        self._packed.extend(forked._packed)
+        self._count += forked._count
+    
+    def packed(self):
+        ''' Get the collected results, encoded into the protocol format '''
+        self._join()
+        return self._pack_items(self._count, self._joined)
     
     def collection(self):
         ''' Get the collected list of results - modifications to the list 
         will not be reflected in this collection '''
-        collected = []
-        collected.extend(self._collected)
-        return collected
+        return self._unpack(self.packed())
 
 _INSTRUCTION_TYPES = {'make':Make,
                       'import':Import,
@@ -68,11 +114,15 @@ def instruction_for(params):
         return Instruction(instruction_id, [instruction_type])
 
 def _debug(logger, msg, substitutions):
-    ''' Log to logger a msg with potentially some substitutions '''
-    try:
-        logger.debug(msg % substitutions)
-    except:
-        logger.warn('Error logging %s:' % msg, exc_info=1)
+    ''' Log to logger a msg with potentially some substitutions, which are
+    only formatted (and abbreviated) if debug is enabled - see logs '''
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if not isinstance(substitutions, tuple):
+        substitutions = (substitutions,)
+    debug(logger, msg, *substitutions)
+
+_FAILURES = RateLimiter()
 
 class Instructions:
     ''' Container for executable sequence of Instruction-s '''
@@ -85,31 +135,288 @@ class Instructions:
         self._logger = logging.getLogger('Instructions')
     
     def execute(self, execution_context, results):
-        ''' Create and execute Instruction-s, collecting the results '''
-        for item in self._unpacked_list:
-            instruction = self._instruction_for(item)
-            _debug(self._logger, 'Executing %r', instruction)
-            try:
-                instruction.execute(execution_context, results)
-            except Exception as error:
-                self._logger.warn('Error executing %s:', instruction, 
-                                  exc_info=1)
-                stop_test = 'stoptest' in type(error).__name__.lower()
-
-                if len(error.args) > 0:
-                    cause = error.args[0]
-                else:
-                    cause = '\n'.join([str(type(error)),traceback.format_exc()])
+        ''' Create and execute Instruction-s, collecting the results, using 
+        the converters of the execution_context (or, for a context written
+        before contexts had converters, those in use already) '''
+        converters = getattr(execution_context, 'converters', None) \
+                     or registered_converters()
+        token = use_registered_converters(converters)
+        try:
+            self._execute_all([self._instruction_for(item) 
+                               for item in self._unpacked_list],
+                              execution_context, results)
+        finally:
+            stop_using_converters(token)
+    
+    def _execute_all(self, instructions, execution_context, results):
+        ''' Execute Instruction-s in sequence. Runs of whole decision table
+        rows on an instance with an execute_rows() method are executed 
+        together (see _decision_rows). '''
+        position = 0
+        batched = {}
+        while position < len(instructions):
+            rows = _decision_rows(instructions, position, execution_context,
+                                  batched)
+            if rows:
+                carry_on = self._execute_rows(rows, execution_context, results)
+                position += sum(map(len, rows))
+            else:
+                carry_on = self._execute(instructions[position], 
+                                         execution_context, results, batched)
+                position += 1
+            if not carry_on:
+                break
+    
+    def _execute(self, instruction, execution_context, results, batched):
+        ''' Execute an Instruction: return False if the test must stop. 
+        Anything but a Call (e.g. a Make) may store an instance, so batched
+        (see _decision_rows) is then cleared. '''
+        _debug(self._logger, 'Executing %r', instruction)
+        if type(instruction) is not Call:
+            batched.clear()
+        try:
+            instruction.execute(execution_context, results)
+        except Exception as error:
+            return self._failed([instruction], error, results)
+        return True
+    
+    def _execute_rows(self, rows, execution_context, results):
+        ''' Hand decision table rows of Call-s to the execute_rows() method 
+        of their instance, in one call, then map the results for each row 
+        back to its Call-s: return False if the test must stop '''
+        instructions = [instruction for row in rows for instruction in row]
+        _debug(self._logger, 'Executing rows %r', (instructions,))
+        try:
+            instance = execution_context.get_instance(
+                rows[0][0].instance_name())
+            calls = [[(instruction.target_name(), 
+                       instruction.args(execution_context)) 
+                      for instruction in row] for row in rows]
+            row_results = instance.execute_rows(calls)
+            if inspect.isawaitable(row_results):
+                row_results = execution_context.run_awaitable(row_results)
+            row_results = [list(row_result) for row_result in row_results]
+            if [len(row) for row in rows] != \
+                [len(row_result) for row_result in row_results]:
+                msg = 'execute_rows() results do not match rows %s'
+                raise ValueError(msg % calls)
+        except Exception as error:
+            return self._failed(instructions, error, results)
+        for row, row_result in zip(rows, row_results):
+            for instruction, result in zip(row, row_result):
+                try:
+                    results.completed(instruction, result)
+                except Exception as error:
+                    if not self._failed([instruction], error, results):
+                        return False
+        return True
+    
+    def _failed(self, instructions, error, results):
+        ''' Instruction-s have failed with an error: return False if the test
+        must stop. Identical failures (of the same type, with the same cause)
+        are only logged once a minute. '''
+        stop_test = 'stoptest' in type(error).__name__.lower()
 
-                results.failed(instruction, cause, stop_test)
-                if stop_test: 
+        if len(error.args) > 0:
+            cause = error.args[0]
+        else:
+            cause = '\n'.join([str(type(error)),traceback.format_exc()])
+        
+        suppressed = _FAILURES.allow((type(error), str(cause)))
+        if suppressed is not None:
+            msg = 'Error executing %s (and %s times more since last logged):'
+            self._logger.warning(msg, Abbreviated(instructions[0]), 
+                                 suppressed, exc_info=1)
+
+        for instruction in instructions:
+            results.failed(instruction, cause, stop_test)
+        return not stop_test
+
+class ParallelInstructions(Instructions):
+    ''' Instructions that are executed in independent groups, concurrently.
+    Instructions are in the same group if they use the same instance or 
+    symbol, and each group is executed in sequence on a thread pool. An 
+    Import, or Make of a library, is a barrier: it is executed only once 
+    everything before it is done, and before anything after it. Results are
+    collected in the original order; if the test is stopped then results 
+    for instructions after the one that stopped it are discarded, groups 
+    that have not started are cancelled and running groups execute nothing
+    further. '''
+    
+    max_workers = 8
+    
+    def _execute_all(self, instructions, execution_context, results):
+        ''' Execute Instruction-s in groups, each group in a copy of the 
+        current contextvars context '''
+        self._stopped_at = len(instructions)
+        self._stop_lock = threading.Lock()
+        self._pending = []
+        pool = None
+        try:
+            for groups in _schedule(instructions, 
+                                    execution_context.symbols_in,
+                                    execution_context.may_fall_back):
+                if len(groups) == 1:
+                    units = self._execute_group(instructions, groups[0], 
+                                                execution_context, results)
+                else:
+                    pool = pool or concurrent.futures.ThreadPoolExecutor(
+                                                        self.max_workers)
+                    with self._stop_lock:
+                        futures = self._pending = [
+                            pool.submit(contextvars.copy_context().run,
+                                        self._execute_group, instructions,
+                                        group, execution_context, results)
+                            for group in groups]
+                    concurrent.futures.wait(futures)
+                    units = [unit for future in futures 
+                                  if not future.cancelled()
+                                  for unit in future.result()]
+                    units.sort(key=operator.itemgetter(0))
+                for position, forked in units:
+                    if position <= self._stopped_at:
+                        results.merge(forked)
+                if self._stopped_at < len(instructions):
                     break
+        finally:
+            if pool:
+                pool.shutdown()
+    
+    def _execute_group(self, instructions, positions, execution_context, 
+                       results):
+        ''' Execute the Instruction-s at some positions, in sequence: return
+        a list of (position, forked results), one for each Instruction (or 
+        run of decision table rows) executed, until the test is stopped '''
+        group = [instructions[position] for position in positions]
+        units = []
+        index = 0
+        batched = {}
+        while index < len(group) and self._stopped_at == len(instructions):
+            position, forked = positions[index], results.fork()
+            rows = _decision_rows(group, index, execution_context, batched)
+            if rows:
+                carry_on = self._execute_rows(rows, execution_context, forked)
+                index += sum(map(len, rows))
+            else:
+                carry_on = self._execute(group[index], execution_context, 
+                                         forked, batched)
+                index += 1
+            units.append((position, forked))
+            if not carry_on:
+                with self._stop_lock:
+                    self._stopped_at = min(self._stopped_at, position)
+                    pending = self._pending
+                for future in pending:
+                    future.cancel()
+                break
+        return units
+
+def _schedule(instructions, symbols_in, may_fall_back):
+    ''' Generate the groups of instruction positions that may be executed 
+    concurrently, in lists: barriers (see ParallelInstructions) are each in
+    a list of their own. Positions are in the same group if the 
+    instructions at them share a dependency (see Instruction.dependencies) 
+    directly, or through other instructions. Calls that may fall back to a
+    library or a system under test (see ExecutionContext.may_fall_back) 
+    share a dependency on those. Calls on an instance made since the last
+    barrier are assumed to, since the instance cannot be checked until it 
+    is made. Each list is only generated once everything before it has been
+    executed. '''
+    owners, parents, made = {}, {}, set()
+    def falls_back(instance_name, method_name):
+        ''' Whether a call may fall back to a library or system under test '''
+        return instance_name in made \
+            or may_fall_back(instance_name, method_name)
+    def root(position):
+        ''' Find the position that represents the group of a position '''
+        while parents[position] != position:
+            parents[position] = parents[parents[position]]
+            position = parents[position]
+        return position
+    def groups():
+        ''' The groups of positions found since the last barrier '''
+        grouped = {}
+        for position in sorted(parents):
+            grouped.setdefault(root(position), []).append(position)
+        return list(grouped.values())
+    
+    for position, instruction in enumerate(instructions):
+        dependencies = instruction.dependencies(symbols_in, falls_back)
+        if dependencies is None:
+            if parents:
+                yield groups()
+            owners, parents, made = {}, {}, set()
+            yield [[position]]
+            continue
+        if not isinstance(instruction, Call):
+            made.update([name for kind, name in dependencies 
+                         if kind == 'instance'])
+        parents[position] = position
+        for dependency in dependencies:
+            try:
+                parents[root(position)] = root(owners[dependency])
+            except KeyError:
+                owners[dependency] = position
+    if parents:
+        yield groups()
+
+async def _awaited(awaitable, context):
+    ''' Coroutine that awaits any awaitable, with the values of the 
+    contextvars in a context (e.g. the converters in use) '''
+    for variable, value in context.items():
+        variable.set(value)
+    return await awaitable
+
+_TABLE_STEPS = ('table', 'begin_table', 'end_table')
+
+def _decision_rows(instructions, start, execution_context, batched):
+    ''' Find the whole decision table rows that are a run of Call-s, from 
+    start, on an instance with an execute_rows() method. Each row is a list
+    of Call-s: an optional "reset", any setters, "execute", then any getters.
+    Calls outside rows (e.g. "table" or "beginTable") are not included. 
+    Whether the instance of each name has an execute_rows() method is 
+    cached in the batched dict, which must be cleared whenever an instance
+    may have been stored. '''
+    first = instructions[start]
+    if type(first) is not Call:
+        return []
+    name = first.instance_name()
+    try:
+        has_execute_rows = batched[name]
+    except KeyError:
+        has_execute_rows = batched[name] = hasattr(
+            execution_context.get_instance(name), 'execute_rows')
+    if not has_execute_rows:
+        return []
+    
+    rows, row, executed = [], [], False
+    for instruction in instructions[start:]:
+        if type(instruction) is not Call \
+        or instruction.instance_name() != name:
+            break
+        step = instruction.target_name() and \
+               to_pythonic(instruction.target_name())
+        if step in _TABLE_STEPS:
+            break
+        if executed and (step in ('reset', 'execute') 
+                         or step.startswith('set_')):
+            rows.append(row)
+            row, executed = [], False
+        elif step == 'reset' and row:
+            break
+        row.append(instruction)
+        executed = executed or step == 'execute'
+    if executed:
+        rows.append(row)
+    return rows
 
 class ParamsConverter:
     ''' Converter from (possibly nested) list of strings (possibly symbols)
     into (possibly nested) tuple of string arguments for invocation''' 
     
     _SYMBOL_PATTERN = re.compile('\\$([a-zA-Z]\\w*)+', re.UNICODE)
+    _SEGMENTS = {}
+    _MAX_SEGMENTS = 4096
     
     def __init__(self, execution_context):
         ''' Provide the execution_context for symbol lookup '''
@@ -121,56 +428,312 @@ class ParamsConverter:
         return tuple(args)
     
     def _lookup_symbol(self, possible_symbol):
-        ''' Lookup (recursively if required) a possible symbol '''
+        ''' Lookup (recursively if required) a possible symbol. Strings with
+        no '$' are returned untouched. Lazy nested chunks (see protocol.Chunk)
+        are not decoded here: the lookup is instead applied to each item as 
+        it is accessed. '''
+        if isinstance(possible_symbol, str):
+            if '$' not in possible_symbol:
+                return possible_symbol
+            return self._substitute(possible_symbol)
         if isinstance(possible_symbol, list):
             return self.to_args(possible_symbol, 0)
-        return ParamsConverter._SYMBOL_PATTERN.sub(self._match, possible_symbol, re.S)
+        if hasattr(possible_symbol, 'with_leaves'):
+            return possible_symbol.with_leaves(self._lookup_symbol)
+        return possible_symbol
+    
+    def _substitute(self, param):
+        ''' Substitute the value of each symbol in a param. A param that is
+        just a symbol is replaced by the symbol's value (see 
+        ExecutionContext.get_symbol_value), otherwise by a str. '''
+        segments = self._segments(param)
+        if len(segments) == 1:
+            return param
+        if len(segments) == 3 and not segments[0] and not segments[2]:
+            return self._execution_context.get_symbol_value(segments[1])
+        parts = list(segments)
+        get_symbol = self._execution_context.get_symbol
+        for index in range(1, len(parts), 2):
+            parts[index] = get_symbol(parts[index])
+        return ''.join(parts)
     
-    def _match(self, match):
-        ''' Actually perform the substitution identified by the match '''
-        if match:
-            return self._execution_context.get_symbol(match.groups()[0])
-        return ''
+    @classmethod
+    def symbols_in(cls, param):
+        ''' Return the names of the symbols used in a (possibly nested) 
+        param '''
+        if isinstance(param, str):
+            if '$' not in param:
+                return ()
+            return cls._segments(param)[1::2]
+        if isinstance(param, (list, tuple)) or hasattr(param, 'with_leaves'):
+            return [name for item in param for name in cls.symbols_in(item)]
+        return ()
+    
+    @classmethod
+    def _segments(cls, param):
+        ''' Split a param into alternating literal and symbol name segments,
+        (literal, name, literal, ... literal): params of the same shape recur
+        throughout tables, so each is only split once '''
+        try:
+            return cls._SEGMENTS[param]
+        except KeyError:
+            if len(cls._SEGMENTS) >= cls._MAX_SEGMENTS:
+                cls._SEGMENTS.clear()
+            segments = cls._SEGMENTS[param] = \
+                tuple(cls._SYMBOL_PATTERN.split(param))
+            return segments
+
+def to_pythonic(name):
+    ''' Returns a name converted from camelCase or CamelCase to 
+    pythonic_case'''
+    return name[0].lower() + \
+        ''.join([_underscored_lowercase(char) for char in name[1:]])
 
-def pythonic(method_name):
-    ''' Returns a method_name converted from camelCase to pythonic_case'''
-    return method_name[0].lower() + \
-        ''.join([_underscored_lowercase(char) for char in method_name[1:]])
+pythonic = to_pythonic
 
 def _underscored_lowercase(char):
     ''' Returns _<lowercase char> if char is uppercase; char otherwise'''
     if char.isupper():
         return '_%s' % char.lower()
     return char
+
+def to_upper_camel_case(name):
+    ''' Returns a name converted from pythonic_case or camelCase to 
+    CamelCase'''
+    return ''.join([part[:1].upper() + part[1:] for part in name.split('_')])
+
+def to_lower_camel_case(name):
+    ''' Returns a name converted from pythonic_case or CamelCase to 
+    camelCase'''
+    upper_camel_case = to_upper_camel_case(name)
+    return upper_camel_case[:1].lower() + upper_camel_case[1:]
+
+def get_classes(module):
+    ''' Introspect a module, generating a (name, data) pair for each class 
+    defined in it. data is a dict of the public "methods" of the class
+    (including static and class methods) and the "aliases" by which fitnesse
+    may refer to them. '''
+    for name, cls in inspect.getmembers(module, inspect.isclass):
+        if cls.__module__ == module.__name__:
+            yield name, _class_data(cls)
+
+def _class_data(cls):
+    ''' Introspect a class for its public methods and their aliases. Besides
+    the aliases from get_aliases(), a get_<name> method is also aliased by 
+    <name> (as used for decision table output columns) unless that clashes
+    with another method. As it always has been, a pythonic_name method is 
+    used in preference to any other: e.g. setCash is an alias of set_cash 
+    even if there is also a setCash method. '''
+    methods = [name for name in dir(cls) if not name.startswith('_') \
+               and inspect.isroutine(getattr(cls, name, None))]
+    aliases = {}
+    for name in methods:
+        if name.startswith('get_') and len(name) > len('get_'):
+            for alias in ExecutionContext.get_aliases([name[len('get_'):]]):
+                aliases[alias] = name
+    aliases.update(ExecutionContext.get_aliases(methods))
+    method_names = set(methods)
+    for alias in aliases:
+        pythonic_name = to_pythonic(alias)
+        if pythonic_name in method_names:
+            aliases[alias] = pythonic_name
+    return {'methods': methods, 'aliases': aliases}
+
+def get_catalog(module):
+    ''' Introspect a fixture module for a catalog of its classes: the data
+    for each class from get_classes(), and the "aliases" by which fitnesse 
+    may refer to the classes themselves '''
+    classes = dict(get_classes(module))
+    aliases = dict([(to_pythonic(name), name) for name in classes])
+    aliases.update(ExecutionContext.get_aliases(classes))
+    return {'module': module.__name__, 'classes': classes, 'aliases': aliases}
+
+def catalog_json(module):
+    ''' Export the catalog of a fixture module as JSON, so that tooling can 
+    inspect it without importing the module '''
+    return json.dumps(get_catalog(module), sort_keys=True, indent=2)
+ 
+class _Unresolved:
+    ''' Cached resolution of a type name that could not be resolved. Each
+    time it is looked up again, a new exception like the original is raised,
+    so that no exception (nor its traceback) is shared between lookups. '''
+    __slots__ = ('_error_type', '_args', '_import_names')
+    
+    def __init__(self, error):
+        ''' Specify the original TypeError or ImportError '''
+        self._error_type = type(error)
+        self._args = error.args
+        self._import_names = isinstance(error, ImportError) \
+                             and {'name': error.name, 'path': error.path} \
+                             or {}
+    
+    def error(self):
+        ''' Return a new exception like the original '''
+        return self._error_type(*self._args, **self._import_names)
+
+def _no_target(instance):
+    ''' Cached resolution for a method that could not be found '''
+    return None
  
+_IMPORTING_CONTEXT = contextvars.ContextVar('importing_context', default=None)
+
+class _ContextPathFinder:
+    ''' Meta path finder that finds top-level modules on the import paths of
+    whichever ExecutionContext is importing in the current thread, if any. 
+    Each context thereby sees its own import paths without sys.path ever 
+    being changed. '''
+    
+    @classmethod
+    def find_spec(cls, fullname, path=None, target=None):
+        ''' Find a top-level module on the importing context's paths '''
+        context = _IMPORTING_CONTEXT.get()
+        if context is None or path is not None or not context._path:
+            return None
+        return importlib.machinery.PathFinder.find_spec(fullname, 
+                                                        list(context._path),
+                                                        target)
+    
+    @classmethod
+    def install(cls):
+        ''' Install the finder (once) ahead of the standard sys.path finder,
+        so that context paths take precedence over sys.path '''
+        if cls in sys.meta_path:
+            return
+        try:
+            position = sys.meta_path.index(importlib.machinery.PathFinder)
+        except ValueError:
+            position = len(sys.meta_path)
+        sys.meta_path.insert(position, cls)
+
+_ISOLATABLE_LOADERS = (importlib.machinery.SourceFileLoader, 
+                       importlib.machinery.SourcelessFileLoader)
+
+_INSTALLED_PATHS = tuple(set(os.path.join(os.path.realpath(path), '') 
+                             for name, path in sysconfig.get_paths().items()
+                             if name in ('stdlib', 'platstdlib', 
+                                         'purelib', 'platlib')))
+
+def _is_installed(origin):
+    ''' Is a module file part of the standard library or an installed 
+    (site-packages) distribution, rather than fixture code? '''
+    return os.path.realpath(origin).startswith(_INSTALLED_PATHS)
+
+_CODE_CACHE = collections.OrderedDict()
+_CODE_CACHE_LOCK = threading.Lock()
+_MAX_CODE_CACHE = 1024 #most module files whose code is kept
+
+def _code_for(spec):
+    ''' Get the code object for a module, compiled (or unmarshalled) only 
+    once per process for each version of its file: contexts that import in
+    isolation then only need to execute it in a fresh namespace. The code of
+    only the latest version of each file, and of only the most recently 
+    used _MAX_CODE_CACHE files, is kept. '''
+    try:
+        mtime = os.stat(spec.origin).st_mtime_ns
+    except (OSError, TypeError):
+        return spec.loader.get_code(spec.name)
+    with _CODE_CACHE_LOCK:
+        try:
+            cached_mtime, code = _CODE_CACHE[spec.origin]
+        except KeyError:
+            cached_mtime = None
+        if cached_mtime == mtime:
+            _CODE_CACHE.move_to_end(spec.origin)
+            return code
+        code = spec.loader.get_code(spec.name)
+        _CODE_CACHE[spec.origin] = (mtime, code)
+        _CODE_CACHE.move_to_end(spec.origin)
+        while len(_CODE_CACHE) > _MAX_CODE_CACHE:
+            _CODE_CACHE.popitem(last=False)
+        return code
+
+def _package_of(module_globals):
+    ''' Return the package for relative imports made from a module '''
+    package = module_globals.get('__package__')
+    if package is None:
+        package = module_globals['__name__']
+        if '__path__' not in module_globals:
+            package = package.rpartition('.')[0]
+    return package
+
 class ExecutionContext:
     ''' Contextual execution environment to allow simultaneous code executions
     to take place in isolation from each other - see keepalive startup arg.'''
     
-    _SEMAPHORE = threading.Semaphore()
-    _REAL_IMPORT = builtins.__import__
-    _SYSPATH = sys.path
-    
     def __init__(self, params_converter=ParamsConverter, 
                  isolate_imports=False,
-                 logger=logging.getLogger('Execution')):
-        ''' Set up the isolated context '''
+                 logger=logging.getLogger('Execution'),
+                 shared_modules=(),
+                 typed_symbols=False):
+        ''' Set up the isolated context. Modules named in shared_modules 
+        (and their submodules) are imported as normal even when imports are
+        isolated, so that they are only loaded once. 
+        If typed_symbols is True then symbols keep the original values 
+        assigned to them, rather than their str conversions (see 
+        store_symbol). '''
         # Fitnesse-specific... 
         self._instances = {}
         self._libraries = [] 
         self._symbols = {} 
+        self._symbol_strings = {}
+        self._typed_symbols = typed_symbols
         self._path = []
         self._type_prefixes = []
         self._params_converter = params_converter(self)
         # Implementation-specific...
         self._isolate_imports = isolate_imports
+        self.converters = isolate_imports and isolated_converters() \
+                                           or registered_converters()
+        self._shared_modules = tuple(shared_modules)
         self._logger = logger
         self._imported = {}
-        self._modules = {}
-        self._modules.update(sys.modules)
+        self._modules = collections.ChainMap({}, sys.modules)
+        self._module_locks = {}
+        self._module_locks_lock = threading.Lock()
+        self._builtins = dict(builtins.__dict__)
+        self._builtins['__import__'] = self._import
+        _ContextPathFinder.install()
+        self._targets = {}
+        self._catalogs = {}
+        self._method_aliases = {}
+        self._search_space = ((), ())
+        self._types = {}
+        self._event_loop = None
+        self._event_loop_thread = None
+        self._event_loop_lock = threading.Lock()
+    
+    @staticmethod
+    def get_aliases(names):
+        ''' Return a dict mapping each name, and its camelCase and CamelCase
+        aliases, to the name itself. A name always maps to itself, even when 
+        it is also an alias of some other name. '''
+        aliases = {}
+        for name in names:
+            aliases[to_lower_camel_case(name)] = name
+            aliases[to_upper_camel_case(name)] = name
+        for name in names:
+            aliases[name] = name
+        return aliases
     
     def get_type(self, fully_qualified_name):
-        ''' Get a type instance from the context '''        
+        ''' Get a type instance from the context. Each name is only resolved
+        once - failures included - until the search space is changed by
+        add_type_prefix() or add_import_path(). '''
+        key = (self._search_space, fully_qualified_name)
+        resolved = self._types.get(key)
+        if resolved is None:
+            try:
+                resolved = self._resolve_type(fully_qualified_name)
+            except (TypeError, ImportError) as error:
+                self._types[key] = _Unresolved(error)
+                raise
+            self._types[key] = resolved
+        elif isinstance(resolved, _Unresolved):
+            raise resolved.error()
+        return resolved
+    
+    def _resolve_type(self, fully_qualified_name):
+        ''' Actually resolve a type, via type prefixes if it is unqualified '''
         dot_pos = fully_qualified_name.rfind('.')
         if dot_pos == -1:
             for prefix in self._type_prefixes:
@@ -188,102 +751,307 @@ class ExecutionContext:
         type_part = fully_qualified_name[dot_pos + 1:]
         module = self.get_module(module_part)
         try:
+            type_part = self._class_aliases(module).get(type_part, type_part)
             _type = getattr(module, type_part)
             return _type
         except AttributeError:
             msg = '%s could not be found in %s' % (type_part, module_part)
             raise TypeError(msg)
         
+    def _class_aliases(self, module):
+        ''' Get the aliases of the classes in a module, from its catalog: 
+        modules are only introspected once (for each context) '''
+        try:
+            return self._catalogs[module.__name__]['aliases']
+        except KeyError:
+            catalog = self._catalogs[module.__name__] = get_catalog(module)
+            return catalog['aliases']
+        except AttributeError:
+            return {}
+        
+    def memory_usage(self):
+        ''' Report the (approximate, shallow) memory in bytes held by this 
+        context's own containers, keyed by name, plus their total. Modules 
+        imported as normal are only viewed through sys.modules, so only 
+        those loaded privately into this context are counted. '''
+        held = {'instances': self._instances, 
+                'libraries': self._libraries,
+                'symbols': self._symbols, 
+                'modules': self._modules.maps[0],
+                'module namespaces': [module.__dict__ for module 
+                                      in self._modules.maps[0].values()],
+                'imported': self._imported,
+                'targets': self._targets,
+                'catalogs': self._catalogs,
+                'types': self._types}
+        usage = dict((name, sys.getsizeof(container)) 
+                     for name, container in held.items())
+        usage['module namespaces'] = sum(map(sys.getsizeof, 
+                                             held['module namespaces']))
+        usage['total'] = sum(usage.values())
+        return usage
+        
+    def get_catalogs(self):
+        ''' Get the catalogs of all fixture modules used in this context '''
+        return dict(self._catalogs)
+        
     def add_type_prefix(self, prefix):
         ''' Add a prefix that may be used to find classes without using long
         fully-dot-qualified names '''
         self._type_prefixes.insert(0, prefix)
+        self._search_space_changed()
+    
+    def _search_space_changed(self):
+        ''' Type prefixes or import paths have changed, so types previously
+        resolved (or not) in this context may now resolve differently '''
+        self._search_space = (tuple(self._type_prefixes), tuple(self._path))
+        self._types.clear()
 
     def get_module(self, fully_qualified_name):
-        ''' Monkey-patch builtin __import__ and sys.path to ensure isolation
-        of the context and do so in a way that prevents multiple contexts
-        trying to monkey-patch simultaneously; perform import / lookup of
-        the module; then reset the global environment including del() of 
-        imported modules from sys.modules '''
-        with ExecutionContext._SEMAPHORE:
-            try:
-                if self._isolate_imports: 
-                    builtins.__import__ = self._import
-                sys.path = self._path
-                sys.path.extend(ExecutionContext._SYSPATH)
-                
-                return self._import_module(fully_qualified_name)
-            finally:
-                sys.path = ExecutionContext._SYSPATH
-                if self._isolate_imports: 
-                    builtins.__import__ = ExecutionContext._REAL_IMPORT
-                    self.cleanup_imports()
+        ''' Perform import / lookup of a module, without changing sys.path or
+        builtin __import__ and without any lock shared between contexts.
+        Modules are found on the context path (see add_import_path) before 
+        sys.path. If imports are isolated then Python source modules that 
+        are not already loaded are loaded privately, into this context only 
+        (see _load) - otherwise they are imported as normal. '''
+        token = _IMPORTING_CONTEXT.set(self)
+        try:
+            return self._import_module(fully_qualified_name)
+        except Exception as e:
+            self._logger.exception(e)
+            self._logger.error('error importing %s', e)
+            return None
+        finally:
+            _IMPORTING_CONTEXT.reset(token)
     
     def cleanup_imports(self):
-        ''' Clean-up imports '''
-        for mod in self._imported.keys():
-            try:
-                del(sys.modules[mod])
-            except KeyError:
-                pass
+        ''' Clean-up imports: modules imported in isolation are never added
+        to sys.modules, so there is only bookkeeping to reset '''
         self._imported = {}
         
     def _import_module(self, fully_qualified_name):
         ''' Actually perform nested module import / lookup of a module '''
-        dot_pos = fully_qualified_name.rfind('.')
-        if dot_pos == -1:
-            return self._import(fully_qualified_name)
-        else:
-            parent_module = fully_qualified_name[:dot_pos]
-            unqualified_name = fully_qualified_name[dot_pos + 1:]
-            self._import_module(parent_module)
-            return self._import(fully_qualified_name, 
-                                fromlist=[unqualified_name])
-    
-    def _import(self, *args, **kwds):
-        ''' If module has already been imported, return it. Otherwise delegate
-        to builtin __import__ and keep note of the imported module.'''
+        if self._isolate_imports:
+            return self._load(fully_qualified_name)
         try:
-            return self._modules[args[0]]
+            return self._modules[fully_qualified_name]
         except KeyError:
             pass
-        _debug(self._logger, 'Importing %s%s', 
-                           (self._isolate_imports and 'isolated ' or '', 
-                            args[0]))
+        _debug(self._logger, 'Importing %s', fully_qualified_name)
+        return importlib.import_module(fully_qualified_name)
+    
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        ''' Replacement for builtin __import__ in modules imported in 
+        isolation, so that their own imports are also made through _load '''
+        fullname = name
+        if level > 0:
+            fullname = importlib.util.resolve_name('.' * level + name, 
+                                                   _package_of(globals))
+        module = self._load(fullname)
+        if fromlist:
+            if hasattr(module, '__path__'):
+                for item in fromlist:
+                    if item != '*' and not hasattr(module, item):
+                        self._load_optional('%s.%s' % (fullname, item))
+            return module
+        if level == 0:
+            return self._load(name.partition('.')[0])
+        if not name:
+            return module
+        cut_off = len(name) - len(name.partition('.')[0])
+        return self._load(fullname[:len(fullname) - cut_off])
+    
+    def _load_optional(self, fullname):
+        ''' Load a submodule named in a fromlist, if there is one '''
         try:
-            mod = ExecutionContext._REAL_IMPORT(*args, **kwds)
-        except Exception as e:
-            self._logger.exception(e)
-            self._logger.error('error importing %s', e)
-            return
-
-        self._imported[mod.__name__] = mod
-        self._modules[mod.__name__] = mod
-        return mod
+            self._load(fullname)
+        except ModuleNotFoundError as error:
+            if error.name != fullname:
+                raise
     
-    def target_for(self, instance, method_name, convert_name=True):
-        ''' Return an instance's named method to use as a call target. 
-        If a pythonically_named method exists it will be used, otherwise the
-        fitnesse standard camelCase method will be returned it it exists. '''
+    def _load(self, fullname):
+        ''' Return an already loaded module, or else load it in isolation. 
+        Only Python source (or bytecode) modules are loaded privately: each 
+        gets a fresh namespace, recorded only in this context, whose own 
+        imports come back through _import. Other modules (e.g. builtin or 
+        extension modules), installed modules (see _is_installed) and shared
+        modules are imported as normal, once per process: so any converters 
+        they register are registered process-wide, not just for this context.
+        The code of each module is only compiled once per process (see 
+        _code_for). A lock per module name stops threads sharing the context
+        from loading a module twice. '''
         try:
-            return getattr(instance, 
-                           convert_name \
-                           and pythonic(method_name) \
-                           or method_name)
+            return self._modules[fullname]
+        except KeyError:
+            pass
+        
+        parent_name, _, child_name = fullname.rpartition('.')
+        if parent_name:
+            parent = self._load(parent_name)
+            try:
+                search_path = parent.__path__
+            except AttributeError:
+                msg = 'No module named %r; %r is not a package'
+                raise ModuleNotFoundError(msg % (fullname, parent_name),
+                                          name=fullname)
+        else:
+            search_path = self._path + sys.path
+        
+        with self._module_lock(fullname):
+            if fullname in self._modules:
+                return self._modules[fullname]
+            spec = None
+            if not self._is_shared(fullname):
+                spec = importlib.machinery.PathFinder.find_spec(fullname, 
+                                                                search_path)
+            if spec is None \
+            or not isinstance(spec.loader, _ISOLATABLE_LOADERS) \
+            or _is_installed(spec.origin):
+                _debug(self._logger, 'Importing %s', fullname)
+                token = use_registered_converters(process_converters())
+                try:
+                    return importlib.import_module(fullname)
+                finally:
+                    stop_using_converters(token)
+            
+            _debug(self._logger, 'Importing isolated %s', fullname)
+            module = importlib.util.module_from_spec(spec)
+            module.__builtins__ = self._builtins
+            self._modules[fullname] = module
+            if parent_name:
+                setattr(parent, child_name, module)
+            try:
+                exec(_code_for(spec), module.__dict__)
+            except:
+                del self._modules[fullname]
+                if parent_name:
+                    delattr(parent, child_name)
+                raise
+            self._imported[fullname] = module
+            return module
+    
+    def _is_shared(self, fullname):
+        ''' Is a module (or a package it is in) shared between contexts? 
+        waferslim itself always is. '''
+        if fullname.partition('.')[0] == __name__.partition('.')[0]:
+            return True
+        for name in self._shared_modules:
+            if fullname == name or fullname.startswith(name + '.'):
+                return True
+        return False
+    
+    def _module_lock(self, fullname):
+        ''' Get the lock for loading a module in this context '''
+        with self._module_locks_lock:
+            try:
+                return self._module_locks[fullname]
+            except KeyError:
+                lock = self._module_locks[fullname] = threading.RLock()
+                return lock
+    
+    def get_target(self, instance, method_name):
+        ''' Return the call target for a named method:
+        -  the named method on the instance (which may be None)
+        -  the named method on the instance's system under test ("sut")
+        -  the named method via libraries
+        -  None, if there is no such method.
+        How the target was found is cached per instance type and method_name
+        (until instances or libraries are next stored) so that, for example,
+        each column of a decision table is only resolved once. A method that
+        was not found is looked for again if the instance may since have 
+        gained it (see _missing_target). '''
+        key = (type(instance), method_name)
+        try:
+            resolution = self._targets[key]
+        except KeyError:
+            resolution = self._resolve_target(instance, method_name)
+            if resolution is _no_target and instance is not None:
+                resolution = self._missing_target(type(instance), method_name)
+            self._targets[key] = resolution
+        try:
+            return resolution(instance)
         except AttributeError:
-            return convert_name \
-                    and self.target_for(instance, method_name, False) \
-                    or None
-    
-    def get_library_method(self, name):
-        ''' Get a method from the library '''
-        _debug(self._logger, 'Getting library method %s', name)
-        for instance in self._libraries:
-            target = self.target_for(instance, name, True)
-            if target:
-                return target
-        return None
+            # e.g. an attribute of one instance but not another of its type
+            return self._resolve_target(instance, method_name)(instance)
+    
+    def may_fall_back(self, instance_name, method_name):
+        ''' Check whether the call target for a method of a named instance 
+        may be found via the instance's system under test or via libraries
+        (see get_target): it may be unless the instance has the method '''
+        instance = self.get_instance(instance_name)
+        return instance is None \
+            or self._attribute_name(instance, method_name) is None
+    
+    def _resolve_target(self, instance, method_name):
+        ''' Find how to get the call target for a named method, returning a
+        callable that gets the target from an instance of the same type '''
+        if instance is not None:
+            attribute_name = self._attribute_name(instance, method_name)
+            if attribute_name:
+                return operator.attrgetter(attribute_name)
+            
+            sut_name = self._attribute_name(instance, 'sut')
+            if sut_name:
+                sut = self._system_under_test(instance, sut_name)
+                attribute_name = self._attribute_name(sut, method_name)
+                if attribute_name:
+                    return lambda instance: getattr(
+                        self._system_under_test(instance, sut_name), 
+                        attribute_name)
+        
+        _debug(self._logger, 'Getting library method %s', method_name)
+        for index, library in enumerate(self._libraries):
+            attribute_name = self._attribute_name(library, method_name)
+            if attribute_name:
+                return lambda instance: getattr(self._libraries[index],
+                                                attribute_name)
+        return _no_target
+    
+    def _missing_target(self, cls, method_name):
+        ''' Find how to get the call target for a named method that was not
+        found for an instance of cls. Fixture code may later give an instance
+        the method, or a "sut" that has it: so instances with a "sut" are 
+        always resolved again, and other instances are resolved again if 
+        they have since gained an attribute of the method's name or "sut". '''
+        resolve = self._resolve_target
+        if hasattr(cls, 'sut'):
+            return lambda instance: resolve(instance, method_name)(instance)
+        names = (pythonic(method_name), method_name, 'sut')
+        def missing_target(instance):
+            ''' Cached resolution for a method that has not been found '''
+            state = getattr(instance, '__dict__', ())
+            for name in names:
+                if name in state:
+                    return resolve(instance, method_name)(instance)
+            return None
+        return missing_target
+    
+    def _attribute_name(self, instance, method_name):
+        ''' Return the name of an instance's attribute to use as the call 
+        target for method_name: a pythonically_named attribute if it exists,
+        otherwise the fitnesse standard camelCase name if it exists, 
+        otherwise a method of which method_name is an alias (e.g. get_total 
+        for total) if there is one, otherwise None '''
+        for name in (pythonic(method_name), method_name):
+            if getattr(instance, name, None):
+                return name
+        return self._aliases_for(type(instance)).get(method_name)
     
+    def _aliases_for(self, cls):
+        ''' Get the aliases of the methods of a class: classes are only 
+        introspected once (for each context) '''
+        try:
+            return self._method_aliases[cls]
+        except KeyError:
+            aliases = self._method_aliases[cls] = _class_data(cls)['aliases']
+            return aliases
+    
+    def _system_under_test(self, instance, sut_name):
+        ''' Return the system under test of an instance: its "sut" attribute
+        or, if that is callable, the result of calling it '''
+        sut = getattr(instance, sut_name)
+        return hasattr(sut, '__call__') and sut() or sut
+        
     def warn_polluting_library_methods(self, library):
         ''' log a warning if libraries have method names "execute" or "reset" 
         since those methods are called for each row in a decision table '''
@@ -298,6 +1066,7 @@ class ExecutionContext:
         _debug(self._logger, 'Storing library instance %r', value)
         self.warn_polluting_library_methods(value)
         self._libraries.insert(0, value)
+        self._targets.clear()
     
     def store_instance(self, name, value):
         ''' Add a name=value pair to the context instances '''
@@ -306,6 +1075,7 @@ class ExecutionContext:
         else:
             _debug(self._logger, 'Storing instance %s=%r', (name, value))
             self._instances[name] = value
+            self._targets.clear()
 
     def get_instance(self, name):
         ''' Get value from a name=value pair in the context instances '''
@@ -317,21 +1087,84 @@ class ExecutionContext:
     def add_import_path(self, path):
         ''' An an import location to the context path '''
         self._path.insert(0, path)
+        self._search_space_changed()
     
     def store_symbol(self, name, value):
-        ''' Add a name=value pair to the context symbols '''
+        ''' Add a name=value pair to the context symbols. If symbols are 
+        typed the value itself is kept, otherwise its str conversion '''
         _debug(self._logger, 'Storing symbol %s=%r', (name, value))
-        self._symbols[name] = to_string(value)
+        if self._typed_symbols:
+            self._symbols[name] = value
+            self._symbol_strings.pop(name, None)
+        else:
+            self._symbols[name] = to_string(value)
 
     def get_symbol(self, name):
-        ''' Get value from a name=value pair in the context symbols '''
+        ''' Get value from a name=value pair in the context symbols, as a str
+        (converted only once, if symbols are typed) '''
+        try:
+            value = self._symbols[name]
+        except KeyError:
+            return '$%s' % name
+        if self._typed_symbols:
+            try:
+                value = self._symbol_strings[name]
+            except KeyError:
+                value = self._symbol_strings[name] = to_string(value)
+        _debug(self._logger, 'Restoring symbol %s=%r', (name, value))
+        return value
+    
+    def get_symbol_value(self, name):
+        ''' Get value from a name=value pair in the context symbols, for use
+        as a whole argument: if symbols are typed this is the original value,
+        without any conversion to (and from) a str '''
+        if not self._typed_symbols:
+            return self.get_symbol(name)
         try:
             value = self._symbols[name]
-            _debug(self._logger, 'Restoring symbol %s=%r', (name, value))
-            return value
         except KeyError:
             return '$%s' % name
+        _debug(self._logger, 'Restoring symbol %s=%r', (name, value))
+        return value
+    
+    def run_awaitable(self, awaitable):
+        ''' Run an awaitable (e.g. the coroutine returned by an async fixture
+        method) to completion on the event loop of this context, and return
+        its result. The loop runs in a thread of its own, so awaitables run
+        from concurrent threads (see ParallelInstructions) overlap. '''
+        future = asyncio.run_coroutine_threadsafe(
+            _awaited(awaitable, contextvars.copy_context()), 
+            self._get_event_loop())
+        return future.result()
+    
+    def _get_event_loop(self):
+        ''' Get the event loop of this context, started when first needed '''
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, 
+                                          name='%r event loop' % self,
+                                          daemon=True)
+                thread.start()
+                self._event_loop, self._event_loop_thread = loop, thread
+            return self._event_loop
+    
+    def close(self):
+        ''' Release any resources held by the context once it is finished
+        with, i.e. stop its event loop (if it was started) '''
+        with self._event_loop_lock:
+            loop, thread = self._event_loop, self._event_loop_thread
+            self._event_loop = self._event_loop_thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
     
     def to_args(self, params, from_position):
         ''' Delegate args construction to the ParamsConverter '''
         return self._params_converter.to_args(params, from_position)
+    
+    def symbols_in(self, param):
+        ''' Delegate finding the symbols used in a param to the 
+        ParamsConverter '''
+        return self._params_converter.symbols_in(param)
@@ -5,12 +5,15 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved 
 '''
+import inspect
+from waferslim.logs import Abbreviated
 
 _BAD_INSTRUCTION = 'INVALID_STATEMENT'
 _NO_CLASS = 'NO_CLASS'
 _NO_CONSTRUCTION = 'COULD_NOT_INVOKE_CONSTRUCTOR'
 _NO_INSTANCE = 'NO_INSTANCE'
 _NO_METHOD = 'NO_METHOD_IN_CLASS'
+_FALLBACK = ('fallback', None)
 
 class Instruction:
     ''' Base class for instructions '''
@@ -29,12 +32,28 @@ class Instruction:
     
     def __repr__(self):
         ''' Return a meaningful representation of the Instruction '''
-        return '%s %s: %s' % (type(self).__name__, self._id, self._params) 
+        return '%s %s: %r' % (type(self).__name__, self._id, 
+                              Abbreviated(self._params))
         
     def execute(self, execution_context, results):
         ''' Base execute() is only called when the instruction type
         was unrecognised -- fail with _BAD_INSTRUCTION '''
         results.failed(self, '%s %s' % (_BAD_INSTRUCTION, self._params[0]))
+    
+    def dependencies(self, symbols_in, falls_back=None):
+        ''' Return the set of instances and symbols this instruction uses, as
+        ('instance', name) and ('symbol', name) pairs, or None if it may 
+        depend on any instruction before it. symbols_in(param) must return 
+        the names of the symbols used in a param; falls_back(instance_name,
+        method_name), if given, whether a call may fall back to a library or
+        a system under test (see Call). Unrecognised instructions use 
+        nothing. '''
+        return set()
+    
+    def _symbols_used(self, params, symbols_in):
+        ''' The ('symbol', name) pairs for the symbols used in params '''
+        return set(('symbol', name) for param in params 
+                                    for name in symbols_in(param))
 
 class Import(Instruction):
     ''' An "import <path or module context>" instruction '''
@@ -48,6 +67,10 @@ class Import(Instruction):
             execution_context.add_type_prefix(path_or_module)
         results.completed(self)
         
+    def dependencies(self, symbols_in, falls_back=None):
+        ''' Imports change how every later instruction is executed '''
+        return None
+        
     def _ispath(self, possible_path):
         ''' True if this is a path, False otherwise '''
         return possible_path.find('/') != -1 or possible_path.find('\\') != -1
@@ -73,10 +96,45 @@ class Make(Instruction):
             cause = '%s %s %s' % (_NO_CONSTRUCTION, 
                                   self._params[1], error.args[0])
             results.failed(self, cause)
+    
+    def dependencies(self, symbols_in, falls_back=None):
+        ''' The instance made, and any symbols in the params. Library 
+        instances may be used by any later Call. '''
+        if self._params[0].lower().startswith('library'):
+            return None
+        return set([('instance', self._params[0])]) | \
+               self._symbols_used(self._params[1:], symbols_in)
 
 class Call(Instruction):
     ''' A "call <instance>, <function>, <args>..." instruction '''
     
+    def instance_name(self):
+        ''' Return the name of the instance to call '''
+        return self._params[0]
+    
+    def target_name(self):
+        ''' Return the name of the method to call '''
+        return self._params[1]
+    
+    def args(self, execution_context):
+        ''' Return the args to call with, after $variable substitution '''
+        return execution_context.to_args(self._params, 2)
+    
+    def dependencies(self, symbols_in, falls_back=None):
+        ''' The instance called, and any symbols in the params. A call whose
+        target may be found via a library or a system under test (unless 
+        falls_back says otherwise, any call) also uses those, as 
+        ('fallback', None): they may be shared by calls on any instance. '''
+        return self._call_dependencies(self._params, symbols_in, falls_back)
+    
+    def _call_dependencies(self, params, symbols_in, falls_back):
+        ''' The dependencies of a call with params [instance, method, ...] '''
+        dependencies = set([('instance', params[0])]) | \
+                       self._symbols_used(params[1:], symbols_in)
+        if falls_back is None or falls_back(params[0], params[1]):
+            dependencies.add(_FALLBACK)
+        return dependencies
+    
     def execute(self, execution_context, results):
         ''' Delegate to _invoke_call then record results on completion '''
         result, is_ok = self._invoke(execution_context, results, self._params)
@@ -90,18 +148,8 @@ class Call(Instruction):
         -  try to invoke the named method via libraries
         '''
         instance_name, target_name = params[0], params[1]
-        instance, target = execution_context.get_instance(instance_name), None
-        
-        if instance is not None:
-            target = execution_context.target_for(instance, target_name)
-            if not target:
-                sut = execution_context.target_for(instance, 'sut')
-                sut = sut and (hasattr(sut, '__call__') and sut() or sut) 
-                target = sut \
-                         and execution_context.target_for(sut, target_name) \
-                         or None
-        if not target:
-            target = execution_context.get_library_method(target_name)
+        instance = execution_context.get_instance(instance_name)
+        target = execution_context.get_target(instance, target_name)
         
         if target:
             return self._result(execution_context, target, params)
@@ -116,9 +164,12 @@ class Call(Instruction):
     
     def _result(self, execution_context, target, params):
         ''' Perform params $variable substitution in the execution_context and 
-        then call target() '''  
+        then call target(), awaiting the result in the execution_context if
+        target is asynchronous '''  
         args = execution_context.to_args(params, 2)
         result = target(*args)
+        if inspect.isawaitable(result):
+            result = execution_context.run_awaitable(result)
         return (result, True)
 
 class CallAndAssign(Call):
@@ -136,3 +187,10 @@ class CallAndAssign(Call):
         if is_ok:
             execution_context.store_symbol(symbol_name, result)
             results.completed(self, result)
+    
+    def dependencies(self, symbols_in, falls_back=None):
+        ''' The symbol assigned, and the dependencies of the call (see 
+        Call.dependencies) '''
+        return set([('symbol', self._params[0])]) | \
+               self._call_dependencies(self._params[1:], symbols_in, 
+                                       falls_back)
@@ -0,0 +1,114 @@
+'''
+Logging helpers that keep the cost of logging off the instruction hot path:
+log levels are checked before anything is formatted, values are only
+formatted (and truncated) if a record is actually emitted, repeated
+identical events can be rate-limited, and records can be handed to a
+background thread to be written.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import logging, logging.handlers, queue, reprlib, threading, time
+
+MAX_LENGTH = 200 #longest str or repr of any one value that will be logged
+
+_REPR = reprlib.Repr()
+_REPR.maxstring = _REPR.maxother = MAX_LENGTH
+_REPR.maxlist = _REPR.maxtuple = _REPR.maxset = _REPR.maxdict = 20
+
+class Abbreviated:
+    ''' Wrapper for a value to log: its str / repr is only made when a log
+    record is formatted, and is truncated to about MAX_LENGTH '''
+    __slots__ = ('_value',)
+
+    def __init__(self, value):
+        ''' Wrap the value '''
+        self._value = value
+
+    def __repr__(self):
+        ''' Truncated repr of the value '''
+        return _REPR.repr(self._value)
+
+    def __str__(self):
+        ''' Truncated str of a str value, or else a truncated repr '''
+        if not isinstance(self._value, str):
+            return _REPR.repr(self._value)
+        if len(self._value) <= MAX_LENGTH:
+            return self._value
+        return '%s...(%s chars)' % (self._value[:MAX_LENGTH],
+                                    len(self._value))
+
+class Lazy:
+    ''' Wrapper for a fn whose result is to be logged: the fn is only called
+    if a log record is formatted, e.g. debug(logger, '%s', Lazy(fn)) '''
+    __slots__ = ('_fn',)
+
+    def __init__(self, fn):
+        ''' Wrap the fn, which takes no args '''
+        self._fn = fn
+
+    def __repr__(self):
+        ''' repr of the fn result '''
+        return repr(self._fn())
+
+    def __str__(self):
+        ''' str of the fn result '''
+        return str(self._fn())
+
+def debug(logger, msg, *args):
+    ''' Log a debug msg with args (see Abbreviated), if debug is enabled '''
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *[Abbreviated(arg) for arg in args])
+
+class RateLimiter:
+    ''' Limits how often each of many distinct, repeated events (e.g.
+    identical failures) is logged: each at most once per interval '''
+
+    def __init__(self, interval=60.0, max_events=1024):
+        ''' Set up the interval (in seconds), and how many distinct events to
+        keep track of '''
+        self._interval = interval
+        self._max_events = max_events
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def allow(self, event):
+        ''' Return None if an event should not be logged, because it was
+        already logged less than an interval ago. Otherwise return the
+        number of times it happened, without being logged, since then. '''
+        now = time.monotonic()
+        with self._lock:
+            try:
+                logged_at, suppressed = self._events[event]
+            except KeyError:
+                if len(self._events) >= self._max_events:
+                    self._events.clear()
+                self._events[event] = (now, 0)
+                return 0
+            if now - logged_at < self._interval:
+                self._events[event] = (logged_at, suppressed + 1)
+                return None
+            self._events[event] = (now, 0)
+            return suppressed
+
+def start_queue_logging(logger_names=('',)):
+    ''' Put the handlers of each named logger (default: the root logger) 
+    behind a QueueHandler, so that records are written by a background 
+    thread rather than by the threads that log them. Return the started 
+    QueueListener-s, to stop() when logging is finished. '''
+    listeners = []
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = logger.handlers[:]
+        if not handlers:
+            continue
+        log_queue = queue.SimpleQueue()
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                                  respect_handler_level=True)
+        listener.start()
+        listeners.append(listener)
+    return listeners
@@ -0,0 +1,128 @@
+'''
+Method decorator for running CPU-heavy fixture methods in a persistent pool
+of worker processes, so that they do not hold the GIL that is shared by all
+the requests a (threaded, keepalive) server is handling.
+
+Use offload as the outermost decorator of a fixture method, e.g.
+    @offload
+    @convert_arg(to_type=int)
+    def checksum(self, size)...
+so that any convert_arg / convert_result conversions also happen in the
+worker process. The args are the standard slim strings (or values of typed
+symbols, or tables of strings as lists), and they and the result must be 
+picklable. The fixture instance is not pickled: a copy of its attributes 
+(including any in __slots__) is made in the worker, and any changes made to
+them there are not seen by the original instance.
+
+Worker processes are spawned (rather than forked from a server that has
+many threads) and import each fixture module by name, or else from its file
+if the module was imported in isolation - see keepalive startup arg.
+Converters registered by the module itself are available in the workers,
+but not those registered in the server while it is running.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import concurrent.futures, functools, importlib, importlib.util, inspect
+import multiprocessing, threading, types
+
+max_workers = None #can be altered before the first method is offloaded
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_WORKER_MODULES = {}
+
+def offload(method):
+    ''' Method decorator to run a fixture method in a worker process '''
+    module_name = method.__module__
+    module_file = inspect.unwrap(method).__globals__.get('__file__')
+    qualified_name = method.__qualname__
+
+    @functools.wraps(method)
+    def offloaded_method(self, *args):
+        ''' callable that delegates to the decorated fn in a worker '''
+        future = _pool().submit(_call, module_name, module_file,
+                                qualified_name, _state(self), 
+                                [_materialized(arg) for arg in args])
+        return future.result()
+    return offloaded_method
+
+def _state(instance):
+    ''' The attributes of an instance, to copy to the worker: those in its
+    __dict__, if it has one, and those in its __slots__ (by the names of 
+    their descriptors) '''
+    slots = {}
+    for cls in type(instance).__mro__:
+        for name, attribute in vars(cls).items():
+            if isinstance(attribute, types.MemberDescriptorType) \
+            and name not in slots:
+                try:
+                    slots[name] = attribute.__get__(instance, cls)
+                except AttributeError:
+                    pass
+    return getattr(instance, '__dict__', {}), slots
+
+def _materialized(arg):
+    ''' An arg that can be pickled: a lazy table arg (see protocol.Chunk), 
+    which refers to its message and context, becomes nested lists of its
+    items, as a table arg that is not lazy would be '''
+    if hasattr(arg, 'with_leaves'):
+        return [_materialized(item) for item in arg]
+    if isinstance(arg, (list, tuple)):
+        return type(arg)([_materialized(item) for item in arg])
+    return arg
+
+def _pool():
+    ''' Get the process pool, created when first needed '''
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            context = multiprocessing.get_context('spawn')
+            _POOL = concurrent.futures.ProcessPoolExecutor(max_workers,
+                                                           mp_context=context)
+        return _POOL
+
+def shutdown():
+    ''' Shut down the worker processes, if they were started: any method
+    offloaded afterwards starts new ones '''
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown()
+
+def _call(module_name, module_file, qualified_name, state, args):
+    ''' Worker side of an offloaded method: find the method, on a copy of
+    the instance (see _state), then call the original (decorated) fn '''
+    owner = _worker_module(module_name, module_file)
+    qualified_names = qualified_name.split('.')
+    for name in qualified_names[:-1]:
+        owner = getattr(owner, name)
+    instance = owner.__new__(owner)
+    attributes, slots = state
+    if attributes:
+        instance.__dict__.update(attributes)
+    for name, value in slots.items():
+        object.__setattr__(instance, name, value)
+    method = getattr(owner, qualified_names[-1]).__wrapped__
+    return method(instance, *args)
+
+def _worker_module(module_name, module_file):
+    ''' Import a module in a worker, from its file if it cannot be imported
+    by name (e.g. it is on the import path of an ExecutionContext) '''
+    try:
+        return _WORKER_MODULES[module_name]
+    except KeyError:
+        pass
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError:
+        if not module_file:
+            raise
+        spec = importlib.util.spec_from_file_location(module_name,
+                                                      module_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    module = _WORKER_MODULES[module_name] = module
+    return module
@@ -10,7 +10,8 @@ Copyright 2009-2010 by the author(s). All rights reserved
 
 from waferslim import WaferSlimException
 from waferslim.execution import Results, ExecutionContext, Instructions
-import re
+from waferslim.logs import Lazy
+import codecs, collections.abc, re
 
 BYTE_ENCODING = 'utf-8' #can be altered by server startup options
 _VERSION = 'Slim -- V0.1\n'
@@ -22,8 +23,11 @@ _NUMERIC_LENGTH = 6
 _NUMERIC_ENCODING = '%%0%sd' % _NUMERIC_LENGTH
 _NUMERIC_BLOCK_LENGTH = len((_NUMERIC_ENCODING % 0).encode(BYTE_ENCODING)) \
     + _SEPARATOR_LENGTH
-_ITEM_ENCODING = _NUMERIC_ENCODING + '%s%s'
 _DISCONNECT = 'bye'
+_HEADER_LENGTH = _NUMERIC_BLOCK_LENGTH
+DEFAULT_READ_SIZE = 64 * 1024
+_DIGIT_BYTES = b'0123456789'
+_EAGER_DEPTH = 2 # instructions, then their params: table args stay lazy
 
 class UnpackingError(WaferSlimException):
     ''' An attempt was made to unpack messages that do not conform 
@@ -37,38 +41,181 @@ class UnpackingError(WaferSlimException):
         ''' Describe this failure '''
         return 'MALFORMED_INSTRUCTION %s' % self.args[0]
     
-def unpack(packed_string):
-    ''' Unpack a chunked-up packed_string into a list '''
+def unpack(packed_string, eager_depth=None):
+    ''' Unpack a chunked-up packed_string into a list. If eager_depth is 
+    specified then only that many levels of nesting are unpacked into lists:
+    chunks nested any deeper are returned as lazy Chunk views. '''
     if isinstance(packed_string, str):
-        chunks = []
-        _unpack_chunk(packed_string, chunks)
-        return chunks
+        _check_chunk(packed_string)
+        return _unpack_chunk(packed_string, 0, len(packed_string), 
+                             eager_depth)
     raise TypeError('%r is not a string' % packed_string)
         
-def _unpack_chunk(packed_chunk, chunks):
-    ''' Unpack a packed chunk, recursively if required '''
-    _check_chunk(packed_chunk)
-    pos = 1
-    chunk_len = int(packed_chunk[pos:pos + _NUMERIC_LENGTH])
-    _check_separator(packed_chunk, pos + _NUMERIC_LENGTH)
-    pos += _NUMERIC_BLOCK_LENGTH 
+def _unpack_chunk(packed_string, start, end, eager_depth=None):
+    ''' Unpack the chunk occupying packed_string[start:end], recursively if 
+    required. The whole message is walked once using integer offsets: only
+    leaf items are sliced out of packed_string, nested chunks are not. '''
+    chunks = []
+    append = chunks.append
+    offsets = _item_offsets(packed_string, start, end)
+    for i in range(0, len(offsets), 2):
+        item_start, item_end = offsets[i], offsets[i + 1]
+        if packed_string.startswith(_START_CHUNK, item_start, item_end) \
+        and _is_chunk_at(packed_string, item_start, item_end):
+            if eager_depth == 1:
+                append(Chunk(packed_string, item_start, item_end))
+            else:
+                append(_unpack_chunk(packed_string, item_start, item_end, 
+                                     eager_depth and eager_depth - 1))
+        else:
+            append(packed_string[item_start:item_end])
+    return chunks
+
+def _item_offsets(packed_string, start, end):
+    ''' Validate the chunk occupying packed_string[start:end] (but not any
+    chunks nested within it) and return the start and end offsets of each 
+    of its items, as a flat list [start0, end0, start1, end1, ...] '''
+    offsets = []
+    append = offsets.append
+    last = end - len(_END_CHUNK)
+    pos = start + len(_START_CHUNK)
+    chunk_len, pos = _read_length(packed_string, start, end, pos)
     
     for i in range(0, chunk_len):
-        item_len = int(packed_chunk[pos:pos + _NUMERIC_LENGTH])
-        _check_separator(packed_chunk, pos + _NUMERIC_LENGTH)
-        pos += _NUMERIC_BLOCK_LENGTH 
+        separator_pos = pos + _NUMERIC_LENGTH
+        if separator_pos < end and _SEPARATOR == packed_string[separator_pos]:
+            try:
+                item_len = int(packed_string[pos:separator_pos])
+                pos = separator_pos + _SEPARATOR_LENGTH
+            except ValueError:
+                item_len, pos = _read_length(packed_string, start, end, pos)
+        else:
+            item_len, pos = _read_length(packed_string, start, end, pos)
+        item_end = pos + item_len
+        if item_end > last:
+            msg = '%r has item of length %s overrunning pos %s' % \
+                    (packed_string[start:end], item_len, last - start)
+            raise UnpackingError(msg)
+        if _SEPARATOR != packed_string[item_end]:
+            _check_separator(packed_string, item_end, start, end)
+        append(pos)
+        append(item_end)
+        pos = item_end + _SEPARATOR_LENGTH
+    return offsets
+
+class Chunk(collections.abc.Sequence):
+    ''' Lazy, read-only view of a chunk nested within a message, e.g. the
+    table argument of a table-table instruction. Only the offsets of its 
+    items are held: each item is decoded when it is accessed, nested chunks
+    becoming further Chunk views. A Chunk supports len(), indexing, slicing
+    and iteration, and compares equal to a tuple or list of equal items. 
+    Malformed chunks raise UnpackingError when first accessed. '''
+    
+    __slots__ = ('_packed_string', '_start', '_end', '_offsets', 
+                 '_convert_leaf')
     
-        item = packed_chunk[pos:pos + item_len]
-        _check_separator(packed_chunk, pos + item_len)
-        pos += (item_len + _SEPARATOR_LENGTH)
+    def __init__(self, packed_string, start, end, convert_leaf=None):
+        ''' Specify the chunk occupying packed_string[start:end] and,
+        optionally, a callable to apply to each leaf (str) item on access '''
+        self._packed_string = packed_string
+        self._start, self._end = start, end
+        self._offsets = None
+        self._convert_leaf = convert_leaf
         
-        if is_chunk(item):
-            sub_chunk = []
-            _unpack_chunk(item, sub_chunk)
-            chunks.append(sub_chunk)
+    def with_leaves(self, convert_leaf):
+        ''' Return a view of the same chunk, with convert_leaf applied (after
+        any existing conversion) to each leaf item on access '''
+        if self._convert_leaf:
+            existing = self._convert_leaf
+            convert = lambda leaf: convert_leaf(existing(leaf))
         else:
-            chunks.append(item)
+            convert = convert_leaf
+        view = Chunk(self._packed_string, self._start, self._end, convert)
+        view._offsets = self._offsets
+        return view
         
+    def _item_offsets(self):
+        ''' Scan (once) for the offsets of the items in this chunk '''
+        if self._offsets is None:
+            self._offsets = _item_offsets(self._packed_string, 
+                                          self._start, self._end)
+        return self._offsets
+    
+    def _item(self, item_start, item_end):
+        ''' Decode the item occupying packed_string[item_start:item_end] '''
+        packed_string = self._packed_string
+        if packed_string.startswith(_START_CHUNK, item_start, item_end) \
+        and _is_chunk_at(packed_string, item_start, item_end):
+            return Chunk(packed_string, item_start, item_end, 
+                         self._convert_leaf)
+        if self._convert_leaf:
+            return self._convert_leaf(packed_string[item_start:item_end])
+        return packed_string[item_start:item_end]
+        
+    def __len__(self):
+        ''' Number of items in this chunk '''
+        return len(self._item_offsets()) // 2
+    
+    def __getitem__(self, index):
+        ''' Decode an item, or a tuple of items if index is a slice '''
+        offsets = self._item_offsets()
+        if isinstance(index, slice):
+            return tuple([self._item(offsets[2 * i], offsets[2 * i + 1])
+                          for i in range(*index.indices(len(offsets) // 2))])
+        if index < 0:
+            index += len(offsets) // 2
+        if not 0 <= index < len(offsets) // 2:
+            raise IndexError('Chunk index out of range')
+        return self._item(offsets[2 * index], offsets[2 * index + 1])
+    
+    def __iter__(self):
+        ''' Decode each item in turn '''
+        offsets = self._item_offsets()
+        for i in range(0, len(offsets), 2):
+            yield self._item(offsets[i], offsets[i + 1])
+            
+    def __eq__(self, other):
+        ''' Equal to another sequence (but not str) of equal items '''
+        if isinstance(other, (Chunk, tuple, list)):
+            return len(self) == len(other) \
+                and all(mine == theirs for mine, theirs in zip(self, other))
+        return NotImplemented
+    
+    def __hash__(self):
+        ''' Hash as the equivalent tuple '''
+        return hash(tuple(self))
+    
+    def __repr__(self):
+        ''' Represent as the equivalent tuple '''
+        return repr(tuple(self))
+
+def _read_length(packed_string, start, end, pos):
+    ''' Read a numeric length (and its trailing separator) at pos within
+    the chunk occupying packed_string[start:end]; return the length and the
+    position following the separator '''
+    separator_pos = pos + _NUMERIC_LENGTH
+    if separator_pos >= end:
+        msg = '%r has no length at pos %s' % (packed_string[start:end], 
+                                              pos - start)
+        raise UnpackingError(msg)
+    if _SEPARATOR != packed_string[separator_pos]:
+        _check_separator(packed_string, separator_pos, start, end)
+    try:
+        return int(packed_string[pos:separator_pos]), \
+               separator_pos + _SEPARATOR_LENGTH
+    except ValueError:
+        msg = '%r has no numeric length at pos %s' % \
+                (packed_string[start:end], pos - start)
+        raise UnpackingError(msg)
+
+def _is_chunk_at(packed_string, start, end):
+    ''' Check, without slicing, whether packed_string[start:end] is an 
+    encoded chunk '''
+    return end - start > 1 \
+        and packed_string.startswith(_START_CHUNK, start, end) \
+        and packed_string.endswith(_END_CHUNK, start, end) \
+        and _CHUNK_HEADER_RE.match(packed_string, start, end) is not None
+
 def _check_chunk(packed_chunk):
     ''' Verify format of an packed_chunk '''
     is_chunk(packed_chunk, raise_on_failure=True)
@@ -77,6 +224,7 @@ CHUNK_RE = re.compile('^\[[0-9]{%s,%s}\:[0-9]{%s,%s}\:' % (_NUMERIC_LENGTH,
                                                            _NUMERIC_LENGTH,
                                                            _NUMERIC_LENGTH,
                                                            _NUMERIC_LENGTH))
+_CHUNK_HEADER_RE = re.compile(CHUNK_RE.pattern[1:])
     
 def is_chunk(possible_chunk, raise_on_failure=False):
     ''' Check for indicative start/end of an encoded chunk '''
@@ -93,29 +241,224 @@ def is_chunk(possible_chunk, raise_on_failure=False):
         return False
     raise UnpackingError(msg)
         
-def _check_separator(packed_chunk, pos):
-    ''' Verify existence of separator at position pos in a packed_chunk '''
-    if _SEPARATOR != packed_chunk[pos]:
+def _check_separator(packed_string, pos, start=0, end=None):
+    ''' Verify existence of separator at position pos in the chunk 
+    occupying packed_string[start:end] '''
+    if _SEPARATOR != packed_string[pos:pos + 1]:
+        packed_chunk = packed_string[start:end]
         msg = '%r has no %r separator at pos %s' % \
-                (packed_chunk, _SEPARATOR, pos)
+                (packed_chunk, _SEPARATOR, pos - start)
         raise UnpackingError(msg)
         
 def pack(item_list):
     ''' Pack each item from a list into the chunked-up format '''
-    packed = [_pack_item(item) for item in item_list]
-    packed.insert(0, _NUMERIC_ENCODING % len(item_list))
-    return '%s%s%s%s' % (_START_CHUNK, _SEPARATOR.join(packed),
-                         _SEPARATOR, _END_CHUNK)
-    
-def _pack_item(item): 
-    ''' Pack (recursively if required) a single item in the format:  
-    [iiiiii:llllll:item...]'''
-    if isinstance(item, list):
-        return _pack_item(pack(item))
-    if isinstance(item, str):
-        return _ITEM_ENCODING % (len(item), _SEPARATOR, item)
-    raise TypeError('%r is not a string' % item)
+    packed = [_LIST_HEADER_ENCODING % len(item_list)]
+    append = packed.append
+    fragments = []
+    for item in item_list:
+        if isinstance(item, str):
+            append(_ITEM_ENCODING % (len(item), item))
+        else:
+            # each nested list is joined as soon as it is packed, so that
+            # only its fragments are ever held at once
+            _pack_items_into((item,), fragments)
+            append(''.join(fragments))
+            fragments.clear()
+    append(_END_CHUNK)
+    return ''.join(packed)
+
+_LIST_HEADER_ENCODING = _START_CHUNK + _NUMERIC_ENCODING + _SEPARATOR
+_ITEM_ENCODING = _NUMERIC_ENCODING + _SEPARATOR + '%s' + _SEPARATOR
+_LIST_ITEM_HEADER_ENCODING = _NUMERIC_ENCODING + _SEPARATOR \
+                             + _LIST_HEADER_ENCODING
+_LIST_ITEM_END = _END_CHUNK + _SEPARATOR
+_LIST_LENGTH = len(_LIST_HEADER_ENCODING % 0 + _END_CHUNK)
+_ITEM_LENGTH = len(_ITEM_ENCODING % (0, ''))
+
+def _pack_items_into(item_list, fragments):
+    ''' Append the items of item_list to fragments, each in the format 
+    llllll:item: and return their total length. A string item is a single
+    fragment; a nested list is packed recursively between a header fragment
+    (a slot reserved before its items, then filled in once their length is
+    known) and an end fragment, so it is never built as a string of its own.
+    '''
+    append = fragments.append
+    length = 0
+    for item in item_list:
+        if isinstance(item, str):
+            item_len = len(item)
+            append(_ITEM_ENCODING % (item_len, item))
+        elif isinstance(item, list):
+            header_at = len(fragments)
+            append(None)
+            item_len = _LIST_LENGTH + _pack_items_into(item, fragments)
+            fragments[header_at] = _LIST_ITEM_HEADER_ENCODING % (item_len, 
+                                                                 len(item))
+            append(_LIST_ITEM_END)
+        else:
+            raise TypeError('%r is not a string' % item)
+        length += _ITEM_LENGTH + item_len
+    return length
+
+_PAIR_ENCODING = _LIST_ITEM_HEADER_ENCODING + 2 * _ITEM_ENCODING \
+                 + _LIST_ITEM_END
+_PAIR_LENGTH = _LIST_LENGTH + 2 * _ITEM_LENGTH
+
+def pack_pair_item(first, second):
+    ''' Pack a list of two items, [first, second], as a single str in the 
+    format llllll:[000002:llllll:first:llllll:second:]: that can later be 
+    completed, with other such items, by pack_items(). Two strings are 
+    packed with a single format; a list item is packed recursively. '''
+    if isinstance(first, str) and isinstance(second, str):
+        first_len, second_len = len(first), len(second)
+        return _PAIR_ENCODING % (_PAIR_LENGTH + first_len + second_len, 2,
+                                 first_len, first, second_len, second)
+    fragments = []
+    _pack_items_into(([first, second],), fragments)
+    return ''.join(fragments)
+
+def pack_items(count, packed_items):
+    ''' Complete the chunked-up format for count items, packed already by
+    pack_pair_item() into packed_items (as strs that may each hold any 
+    number of consecutive items) '''
+    return '%s%s%s' % (_LIST_HEADER_ENCODING % count, ''.join(packed_items), 
+                       _END_CHUNK)
             
+class MessageReader:
+    ''' Buffered reader of length-prefixed messages from a socket. 
+    Bytes are received with recv_into() into a single reusable bytearray, 
+    which only grows when a message is larger than anything seen so far:
+    reading a large message therefore takes linear time, and any bytes 
+    received beyond the end of one message are kept for the next one. '''
+    
+    def __init__(self, request, read_size=DEFAULT_READ_SIZE):
+        ''' Specify the request (socket) to read from and the initial size
+        of the buffer that bytes are received into '''
+        self._request = request
+        self._buffer = bytearray(read_size)
+        self._start, self._end = 0, 0
+        self.bytes_read = 0
+    
+    def read_length(self):
+        ''' Read an initial numeric header (at least the number of digits 
+        defined in _NUMERIC_LENGTH, followed by a separator) and return its 
+        value. Lengths too large for _NUMERIC_LENGTH digits are accepted. '''
+        header_length = _HEADER_LENGTH
+        self._fill(header_length)
+        while self._buffer[self._start + header_length - 1] in _DIGIT_BYTES:
+            header_length += 1
+            self._fill(header_length)
+        header = self._consume(header_length).decode(BYTE_ENCODING)
+        if not header.endswith(_SEPARATOR) or not header[:-1].isdigit():
+            raise UnpackingError('%r is not a message length header' % header)
+        return int(header[:-1])
+        
+    def read_message(self, message_length):
+        ''' Read and decode a message whose length is message_length. 
+        The length is normally a byte count, but some Slim clients send a
+        character count: when message_length bytes do not decode to a whole
+        message, exactly enough further bytes are read to make up 
+        message_length characters. '''
+        self._fill(message_length)
+        data = self._consume(message_length)
+        try:
+            message = data.decode(BYTE_ENCODING)
+            if len(message) == message_length or _is_whole_message(message):
+                return message
+        except UnicodeDecodeError:
+            pass
+        
+        decoder = codecs.getincrementaldecoder(BYTE_ENCODING)()
+        parts = [decoder.decode(data)]
+        remaining = message_length - len(parts[0])
+        while remaining > 0:
+            # each outstanding character is at least one more byte 
+            self._fill(remaining)
+            parts.append(decoder.decode(self._consume(remaining)))
+            remaining -= len(parts[-1])
+        parts.append(decoder.decode(b'', True))
+        return ''.join(parts)
+    
+    def _consume(self, size):
+        ''' Take size bytes from the front of the buffer '''
+        start = self._start
+        self._start += size
+        self.bytes_read += size
+        return bytes(memoryview(self._buffer)[start:self._start])
+    
+    def _fill(self, size):
+        ''' Receive until at least size unconsumed bytes are buffered, 
+        first moving any unconsumed bytes to the front of the buffer (and 
+        growing it) if there is not enough space after them '''
+        available = self._end - self._start
+        if available >= size:
+            return
+        if self._start + size > len(self._buffer):
+            self._buffer[:available] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, available
+            if size > len(self._buffer):
+                grow_to = max(size, 2 * len(self._buffer))
+                self._buffer.extend(bytes(grow_to - len(self._buffer)))
+        
+        while self._end - self._start < size:
+            view = memoryview(self._buffer)[self._end:]
+            try:
+                received = self._request.recv_into(view)
+            finally:
+                view.release()
+            if not received:
+                msg = 'Connection closed with %s of %s bytes received'
+                raise EOFError(msg % (self._end - self._start, size))
+            self._end += received
+
+def _is_whole_message(message):
+    ''' Check whether a decoded message is complete: the items of a chunk,
+    read by their length headers, must end exactly at its end (a message 
+    that was cut short can still look like a chunk, since it may end with a
+    nested chunk) '''
+    if message == _DISCONNECT:
+        return True
+    if not is_chunk(message):
+        return False
+    try:
+        offsets = _item_offsets(message, 0, len(message))
+    except UnpackingError:
+        return False
+    items_end = offsets and offsets[-1] + _SEPARATOR_LENGTH \
+                or len(_START_CHUNK) + _HEADER_LENGTH
+    return items_end == len(message) - len(_END_CHUNK)
+
+def send_buffers(request, buffers):
+    ''' Send a sequence of bytes-like buffers, in order and in full, over the
+    request (socket) without concatenating them: a vectored sendmsg() is used
+    where available, otherwise sendall() for each buffer. Return the total
+    number of bytes sent. '''
+    views = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    total = sum([len(view) for view in views])
+    if not hasattr(request, 'sendmsg'):
+        for view in views:
+            request.sendall(view)
+        return total
+    
+    while views:
+        sent = request.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+    return total
+
+def _context_args(isolate_imports, shared_modules, typed_symbols):
+    ''' Keyword args for an execution context factory: those that are not
+    needed (i.e. that are defaults) are left out, so that factories written 
+    before they were added can still be used '''
+    context_args = {'isolate_imports': isolate_imports}
+    if shared_modules:
+        context_args['shared_modules'] = shared_modules
+    if typed_symbols:
+        context_args['typed_symbols'] = typed_symbols
+    return context_args
+
 class RequestResponder:
     ''' Mixin class for responding to Slim requests.
     Logic mostly reverse engineered from Java test classes especially 
@@ -124,7 +467,10 @@ class RequestResponder:
     def respond_to_request(self, instructions=Instructions,
                                  execution_context=ExecutionContext,
                                  isolate_imports=False,
-                                 results=Results):
+                                 results=Results,
+                                 read_size=DEFAULT_READ_SIZE,
+                                 shared_modules=(),
+                                 typed_symbols=False):
         ''' Entry point for mixin: respond to a Slim protocol request.
         Basic format of every interaction is:
         - every request requires an initial ACK with the Slim Version
@@ -132,10 +478,19 @@ class RequestResponder:
         - receiving a 'bye' message will terminate the loop 
         '''
         ack_bytes = self._send_ack(self.request)
-        context = execution_context(isolate_imports=isolate_imports)
-        received, sent = self._message_loop(instructions,
-                                            context,
-                                            results)
+        self._reader = MessageReader(self.request, read_size)
+        context = execution_context(**_context_args(isolate_imports,
+                                                    shared_modules,
+                                                    typed_symbols))
+        try:
+            received, sent = self._message_loop(instructions,
+                                                context,
+                                                results)
+            if hasattr(context, 'memory_usage'):
+                self.debug('Context memory: %s', Lazy(context.memory_usage))
+        finally:
+            if hasattr(context, 'close'):
+                context.close()
         
         return received, sent + ack_bytes
     
@@ -143,7 +498,7 @@ class RequestResponder:
         ''' Acknowledge the request by sending the Slim Version '''
         response = _VERSION.encode(BYTE_ENCODING)
         self.debug('Send Ack')
-        return request.send(response)
+        return send_buffers(request, [response])
     
     def _message_loop(self, instructions, execution_context, new_result):
         ''' Receive messages from the request and send responses.
@@ -151,58 +506,46 @@ class RequestResponder:
         in _NUMERIC_LENGTH) which contains the byte length
         of the message contents. The message contents can then be read, 
         their instructions executed, and the results returned.'''
-        received, sent = 0, 0
+        sent = 0
         
         while True:
-            message_length, bytes_received = self._get_message_length()
-            self.debug('Next message %s bytes' % message_length)
-            received += bytes_received
+            message_length = self._get_message_length()
+            self.debug('Next message %s bytes', message_length)
 
             message = self._get_message(message_length)
-            received += message_length
 
             if _DISCONNECT == message:
                 break
 
             result = new_result()
             try:
-                instruction_list = instructions(unpack(message))
+                instruction_list = instructions(unpack(message, 
+                                                       _EAGER_DEPTH))
                 instruction_list.execute(execution_context, result)
             except UnpackingError as error:
                 result.failed(error, error.description())
 
-            results = result.collection()
-            self.debug('Results: %r' % results)
-            formatted_response = self._format_response(pack(results))
-            sent += self.request.send(formatted_response)
+            packed = result.packed()
+            self.debug('Results: %s', packed)
+            response = self._format_response(packed.encode(BYTE_ENCODING))
+            sent += send_buffers(self.request, response)
         
-        return received, sent
+        return self._reader.bytes_read, sent
     
     def _get_message_length(self):
         ''' Get the length of the message from an initial numeric header '''
-        header_format = (_NUMERIC_ENCODING % 0) + _SEPARATOR 
-        byte_size = len(header_format.encode(BYTE_ENCODING))
-        data = self.request.recv(byte_size).decode(BYTE_ENCODING)
-        length = int(data[0:_NUMERIC_LENGTH])
-        return length, byte_size
+        return self._reader.read_length()
     
     def _get_message(self, message_length):
-        ''' Receive a message of a known length, in parts''' 
-        message, remaining = b'', message_length
-        while remaining > 0:
-            # Try 1k to work around incorrect message_length with utf-8
-            data = self.request.recv(1024) 
-            self.debug('Recv %s bytes...' % len(data))
-            message += data
-            remaining = message_length - len(message)
-        return message.decode(BYTE_ENCODING)
-    
-    def _format_response(self, msg):
-        ''' Encode the bytes and add the length in an initial numeric header'''
-        msg_bytes = msg.encode(BYTE_ENCODING)
-        response_str = _ITEM_ENCODING % (len(msg_bytes), _SEPARATOR, msg)
-        return response_str.encode(BYTE_ENCODING)
-
-    def debug(self, msg):
-        ''' log a debug msg '''
+        ''' Receive a message of a known length ''' 
+        return self._reader.read_message(message_length)
+    
+    def _format_response(self, msg_bytes):
+        ''' Return the encoded message preceded by a separate initial numeric 
+        header containing its byte length '''
+        header = _NUMERIC_ENCODING % len(msg_bytes) + _SEPARATOR
+        return [header.encode(BYTE_ENCODING), msg_bytes]
+
+    def debug(self, msg, *args):
+        ''' log a debug msg, formatted with args only if it is logged '''
         pass
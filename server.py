@@ -20,6 +20,18 @@ Run this module to start the WaferSlimServer listening on a host / port:
                                  (default: False)
      -l FILE, --logconf=...      use logging configuration from FILE
      -s PATH, --syspath=...      add entries from PATH to sys.path
+     -m MODULES, --shared=...    comma-separated MODULES (and submodules) to
+                                 import once, rather than in isolation for
+                                 each request, when keepalive is used
+     -w N, --workers=...         execute independent tables concurrently,
+                                 with up to N threads (default: 0, i.e. 
+                                 execute every instruction in sequence)
+     -t, --typedsymbols          keep python values assigned to symbols,
+                                 rather than their str conversions
+                                 (default: False)
+     -c N, --cache=...           remember up to N conversions of str args
+                                 to each immutable type (e.g. int, date)
+                                 (default: 0, i.e. convert every arg)
     
     A "trailing" numeric value is assumed to be a port number
     if no explicit PORT is specified, so the following are equivalent
@@ -31,9 +43,10 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved 
 '''
-import codecs, logging.config, os, socketserver, sys
+import atexit, codecs, logging.config, os, socket, socketserver, sys
 from optparse import OptionParser
-import waferslim.protocol
+import waferslim.converters, waferslim.execution, waferslim.logs, \
+       waferslim.protocol
 
 _LOGGER_NAME = 'WaferSlimServer'
 _ALL_LOGGER_NAMES = (_LOGGER_NAME, 'Instructions', 'Execution')
@@ -44,15 +57,31 @@ class SlimRequestHandler(socketserver.BaseRequestHandler,
     the server -- in turn most of the work is passed off to the mixin class
     RequestResponder '''
       
+    def setup(self):
+        ''' Disable Nagle's algorithm: acks and responses are always sent
+        whole, so there is nothing to gain by holding small ones back '''
+        try:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+        
     def handle(self):
         ''' log some info about the request then pass off to mixin class '''
         from_addr = '%s:%s' % self.client_address
         self.info('Handling request from %s' % from_addr)
         
         try:
-            received, sent = self.respond_to_request(isolate_imports=SlimRequestHandler.ISOLATE_IMPORTS)
+            received, sent = self.respond_to_request(isolate_imports=SlimRequestHandler.ISOLATE_IMPORTS,
+                                        shared_modules=SlimRequestHandler.SHARED_MODULES,
+                                        typed_symbols=SlimRequestHandler.TYPED_SYMBOLS,
+                                        instructions=SlimRequestHandler.INSTRUCTIONS)
             done_msg = 'Done with %s: %s bytes received, %s bytes sent'
             self.info(done_msg % (from_addr, received, sent))
+            if SlimRequestHandler.CACHES:
+                self.debug('Conversion caches: %s', 
+                           dict((for_type.__name__, cache.cache_info())
+                                for for_type, cache 
+                                in SlimRequestHandler.CACHES.items()))
         except Exception as error:
             logging.error(error, exc_info=1)
 
@@ -62,9 +91,10 @@ class SlimRequestHandler(socketserver.BaseRequestHandler,
         ''' log an info msg - present in this class to allow use from mixin'''
         logging.getLogger(_LOGGER_NAME).info(msg)
         
-    def debug(self, msg):
-        ''' log a debug msg - present in this class to allow use from mixin'''
-        logging.getLogger(_LOGGER_NAME).debug(msg)
+    def debug(self, msg, *args):
+        ''' log a debug msg - present in this class to allow use from mixin.
+        args are only formatted, abbreviated, if debug is enabled '''
+        waferslim.logs.debug(logging.getLogger(_LOGGER_NAME), msg, *args)
 
 class WaferSlimServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     ''' Standard python library threaded TCP socket server __init__-ed 
@@ -74,6 +104,20 @@ class WaferSlimServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
         ''' Initialise socket server on host and port, with logging '''
         self._keepalive = options.keepalive
         SlimRequestHandler.ISOLATE_IMPORTS = options.keepalive
+        SlimRequestHandler.SHARED_MODULES = \
+            tuple(name.strip() for name in options.shared.split(',') 
+                  if name.strip())
+        SlimRequestHandler.TYPED_SYMBOLS = options.typedsymbols
+        SlimRequestHandler.INSTRUCTIONS = waferslim.execution.Instructions
+        SlimRequestHandler.CACHES = {}
+        if int(options.cache) > 0:
+            SlimRequestHandler.CACHES = \
+                waferslim.converters.memoize_converters(int(options.cache))
+        if int(options.workers) > 0:
+            waferslim.execution.ParallelInstructions.max_workers = \
+                int(options.workers)
+            SlimRequestHandler.INSTRUCTIONS = \
+                waferslim.execution.ParallelInstructions
         if options.verbose:
             for name in _ALL_LOGGER_NAMES:
                 logging.getLogger(name).setLevel(logging.DEBUG)
@@ -119,16 +163,36 @@ def _get_options():
     parser.add_option('-s', '--syspath', dest='syspath', 
                       metavar='SYSPATH', default='', 
                       help='add entries from SYSPATH to sys.path')
+    parser.add_option('-m', '--shared', dest='shared', 
+                      metavar='MODULES', default='', 
+                      help='import comma-separated MODULES only once, '
+                           'even with keepalive')
+    parser.add_option('-w', '--workers', dest='workers', 
+                      metavar='N', default='0', 
+                      help='execute independent tables with up to N threads '
+                           '(default: 0, i.e. in sequence)')
+    parser.add_option('-t', '--typedsymbols', dest='typedsymbols', 
+                      default=False, action='store_true',
+                      help='keep python values assigned to symbols, '
+                           'not str conversions (default: False)')
+    parser.add_option('-c', '--cache', dest='cache', 
+                      metavar='N', default='0', 
+                      help='remember up to N conversions to each immutable '
+                           'type (default: 0, i.e. none)')
     return parser.parse_args()
 
 def _setup_logging(options):
-    ''' Configure standard logging package '''
+    ''' Configure standard logging package, with records written by a
+    background thread '''
     if os.path.exists(options.logconf):
         logging.config.fileConfig(options.logconf)
     else:
         logging.basicConfig()
         if options.logconf:
-            logging.warn('Invalid logging config file: %s' % options.logconf)
+            logging.warning('Invalid logging config file: %s' % options.logconf)
+    listeners = waferslim.logs.start_queue_logging(('',) + _ALL_LOGGER_NAMES)
+    for listener in listeners:
+        atexit.register(listener.stop)
 
 def _setup_syspath(options):
     ''' Configure syspath '''
@@ -1,5 +1,20 @@
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import enum
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
 import unittest
-from waferslim import execution
+from waferslim import converters, execution, instructions, logs, offload, \
+                      protocol, StopTestException, \
+                      WaferSlimException
 from waferslim.tests.fixtures import echo_fixture
 
 
@@ -74,5 +89,1293 @@ class GetClassesTestCase(unittest.TestCase):
         )
 
 
+class PackTestCase(unittest.TestCase):
+    def test_pack_nested_lists(self):
+        self.assertEqual(protocol.pack([]), '[000000:]')
+        self.assertEqual(protocol.pack(['a', ['b']]),
+                         '[000002:000001:a:000018:[000001:000001:b:]:]')
+
+    def test_pack_deeply_nested_lists(self):
+        item_list = ['a', [['b', 'c'], 'd'], [[['\u00e9']]]]
+        self.assertEqual(protocol.unpack(protocol.pack(item_list)), item_list)
+
+    def test_pack_rejects_non_strings(self):
+        self.assertRaises(TypeError, protocol.pack, [['a', 1]])
+
+
+class _DecisionFixture(object):
+    def set_cash(self, value):
+        self.cash = value
+
+    def get_total(self):
+        return self.cash
+
+    def total_items(self):
+        return 1
+
+
+class _BothNamesFixture(object):
+    def set_cash(self, value):
+        return 'pythonic'
+
+    def setCash(self, value):
+        return 'camel case'
+
+    def getTotal(self):
+        return 'camel case'
+
+
+class _AttributeAndGetterFixture(object):
+    def __init__(self):
+        self.total = lambda: 'attribute'
+
+    def get_total(self):
+        return 'getter'
+
+    def get_items(self):
+        return 'getter'
+
+
+class CatalogTestCase(unittest.TestCase):
+    def test_pythonic_names_are_preferred(self):
+        context = execution.ExecutionContext()
+        fixture = _BothNamesFixture()
+        for name in ['setCash', 'SetCash', 'set_cash']:
+            self.assertEqual(context.get_target(fixture, name)('0'), 
+                             'pythonic')
+        self.assertEqual(context.get_target(fixture, 'getTotal')(), 
+                         'camel case')
+
+    def test_attributes_are_preferred_to_get_prefixed_methods(self):
+        context = execution.ExecutionContext()
+        fixture = _AttributeAndGetterFixture()
+        self.assertEqual(context.get_target(fixture, 'total')(), 'attribute')
+        self.assertEqual(context.get_target(fixture, 'items')(), 'getter')
+
+    def test_get_prefixed_methods_are_aliased(self):
+        aliases = execution._class_data(_DecisionFixture)['aliases']
+        self.assertEqual(aliases['setCash'], 'set_cash')
+        self.assertEqual(aliases['total'], 'get_total')
+        self.assertEqual(aliases['getTotal'], 'get_total')
+        self.assertEqual(aliases['totalItems'], 'total_items')
+
+    def test_catalog_json(self):
+        catalog = json.loads(execution.catalog_json(echo_fixture))
+        self.assertEqual(catalog['module'], echo_fixture.__name__)
+        self.assertEqual(catalog['aliases']['echoFixture'], 'EchoFixture')
+        self.assertEqual(catalog['aliases']['echo_fixture'], 'EchoFixture')
+        self.assertEqual(
+            catalog['classes']['EchoFixture']['aliases']['StaticEcho'],
+            'static_echo')
+
+    def test_make_and_call_by_alias(self):
+        context = execution.ExecutionContext()
+        context.add_type_prefix(echo_fixture.__name__)
+        results = execution.Results()
+        for instruction in [
+                instructions.Make('m_0', ['echoer', 'echoFixture']),
+                instructions.Call('c_0', ['echoer', 'ClassEcho', 'hi'])]:
+            instruction.execute(context, results)
+        self.assertEqual(results.collection(),
+                         [['m_0', 'OK'], ['c_0', 'hi']])
+        self.assertTrue(echo_fixture.__name__ in context.get_catalogs())
+
+
+class _CountingContext(execution.ExecutionContext):
+    def __init__(self, *args, **kwds):
+        super(_CountingContext, self).__init__(*args, **kwds)
+        self.modules_got = []
+
+    def get_module(self, fully_qualified_name):
+        self.modules_got.append(fully_qualified_name)
+        return super(_CountingContext, self).get_module(fully_qualified_name)
+
+
+class TypeResolutionTestCase(unittest.TestCase):
+    def test_resolutions_and_failures_are_cached(self):
+        context = _CountingContext()
+        context.add_type_prefix(echo_fixture.__name__)
+        context.add_type_prefix('waferslim.examples.library')
+        for i in range(3):
+            self.assertTrue(context.get_type('EchoFixture')
+                            is echo_fixture.EchoFixture)
+            self.assertRaises(TypeError, context.get_type, 'Missing')
+        self.assertEqual(len(context.modules_got), 4)
+
+    def test_cache_invalidated_by_search_space_changes(self):
+        context = _CountingContext()
+        self.assertRaises(TypeError, context.get_type, 'EchoFixture')
+        context.add_type_prefix(echo_fixture.__name__)
+        self.assertTrue(context.get_type('EchoFixture')
+                        is echo_fixture.EchoFixture)
+
+    def test_cached_failures_raise_new_exceptions(self):
+        context = _CountingContext()
+        errors = []
+        for i in range(2):
+            for name in ['Missing', 'no_such_module.Missing']:
+                try:
+                    context.get_type(name)
+                except (TypeError, ImportError) as error:
+                    errors.append(error)
+        self.assertEqual(len(set(map(id, errors))), 4)
+        self.assertEqual([str(error) for error in errors[:2]],
+                         [str(error) for error in errors[2:]])
+        for error in errors:
+            self.assertFalse(isinstance(error.__context__, KeyError))
+        for error in errors[2:]:
+            self.assertTrue(error.__context__ is None)
+            self.assertTrue(error.__traceback__.tb_next.tb_next is None)
+        unresolved = execution._Unresolved(ModuleNotFoundError('m', name='m'))
+        self.assertEqual(unresolved.error().name, 'm')
+
+
+class ImportIsolationTestCase(unittest.TestCase):
+    files = {
+        'isolated_fixture.py': 'import isolated_helper\n'
+                               'from isolated_pkg import sub\n'
+                               'isolated_helper.LOADED.append(1)\n'
+                               'class Fixture(object):\n'
+                               '    pass\n',
+        'isolated_helper.py': 'LOADED = []\n',
+        os.path.join('isolated_pkg', '__init__.py'): 'from .sub import X\n',
+        os.path.join('isolated_pkg', 'sub.py'): 'X = 42\n',
+        os.path.join('isolated_pkg', 'cycle.py'): 'from . import cycled\n',
+        os.path.join('isolated_pkg', 'cycled.py'): 'from . import cycle\n',
+        'isolated_stdlib.py': 'import multiprocessing.pool\n'
+                              'from xml.dom import minidom\n',
+        'shared_converting.py': 'from waferslim import converters\n'
+                                'class Money(object):\n'
+                                '    pass\n'
+                                'class MoneyConverter(converters.Converter):\n'
+                                '    def to_string(self, value):\n'
+                                '        return "money"\n'
+                                'converters.register_converter(\n'
+                                '    Money, MoneyConverter())\n',
+    }
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        os.mkdir(os.path.join(self.path, 'isolated_pkg'))
+        for name, source in self.files.items():
+            with open(os.path.join(self.path, name), 'w') as module_file:
+                module_file.write(source)
+
+    def context(self, isolate_imports=True, shared_modules=()):
+        context = execution.ExecutionContext(isolate_imports=isolate_imports,
+                                             shared_modules=shared_modules)
+        context.add_import_path(self.path + os.sep)
+        return context
+
+    def test_isolated_contexts_get_their_own_modules(self):
+        sys_path = list(sys.path)
+        threads, modules = [], []
+        for i in range(4):
+            thread = threading.Thread(target=lambda: modules.append(
+                self.context().get_module('isolated_fixture')))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(set(id(module) for module in modules)), 4)
+        for module in modules:
+            self.assertEqual(module.isolated_helper.LOADED, [1])
+            self.assertEqual(module.sub.X, 42)
+        for name in ['isolated_fixture', 'isolated_helper', 'isolated_pkg']:
+            self.assertFalse(name in sys.modules)
+        self.assertEqual(sys.path, sys_path)
+
+    def test_module_is_loaded_once_per_context(self):
+        context = self.context()
+        self.assertTrue(context.get_type('isolated_fixture.Fixture')
+                        is context.get_module('isolated_fixture').Fixture)
+
+    def test_installed_modules_are_imported_normally(self):
+        module = self.context().get_module('isolated_stdlib')
+        self.assertTrue(module.multiprocessing 
+                        is sys.modules['multiprocessing'])
+        self.assertTrue(module.minidom is sys.modules['xml.dom.minidom'])
+        self.assertTrue(self.context().get_module('colorsys') 
+                        is sys.modules['colorsys'])
+
+    def test_circular_submodule_imports(self):
+        module = self.context().get_module('isolated_pkg.cycle')
+        self.assertTrue(module.cycled.cycle is module)
+        self.assertFalse('isolated_pkg.cycle' in sys.modules)
+
+    def test_module_code_is_compiled_once(self):
+        first = self.context().get_module('isolated_helper')
+        second = self.context().get_module('isolated_helper')
+        self.assertFalse(first is second)
+        self.assertTrue(first.__spec__.origin in execution._CODE_CACHE)
+        code_cache = dict(execution._CODE_CACHE)
+        self.context().get_module('isolated_helper')
+        self.assertEqual(code_cache, execution._CODE_CACHE)
+
+    def test_code_cache_is_bounded_and_replaces_stale_code(self):
+        origin = self.context().get_module('isolated_helper').__spec__.origin
+        with open(origin, 'w') as module_file:
+            module_file.write('LOADED = [2]\n')
+        mtime = os.stat(origin).st_mtime_ns
+        os.utime(origin, ns=(mtime + 10**9, mtime + 10**9))
+        self.assertEqual(self.context().get_module('isolated_helper').LOADED,
+                         [2])
+        self.assertEqual(execution._CODE_CACHE[origin][0], mtime + 10**9)
+        max_code_cache = execution._MAX_CODE_CACHE
+        self.addCleanup(setattr, execution, '_MAX_CODE_CACHE', max_code_cache)
+        execution._MAX_CODE_CACHE = 2
+        self.context().get_module('isolated_fixture')
+        self.assertEqual(len(execution._CODE_CACHE), 2)
+        self.assertFalse(origin in execution._CODE_CACHE)
+
+    def test_shared_modules_are_imported_normally(self):
+        for name in ['isolated_pkg', 'isolated_pkg.sub', 'isolated_helper']:
+            self.addCleanup(sys.modules.pop, name, None)
+        shared = ['isolated_pkg', 'isolated_helper']
+        first = self.context(shared_modules=shared)
+        second = self.context(shared_modules=shared)
+        fixture = first.get_module('isolated_fixture')
+        self.assertFalse(fixture is second.get_module('isolated_fixture'))
+        self.assertTrue(fixture.sub is sys.modules['isolated_pkg.sub'])
+        self.assertTrue(fixture.isolated_helper is
+                        second.get_module('isolated_fixture').isolated_helper)
+        self.assertEqual(fixture.isolated_helper.LOADED, [1, 1])
+        self.assertFalse('isolated_fixture' in sys.modules)
+
+    def test_shared_modules_register_converters_process_wide(self):
+        self.addCleanup(sys.modules.pop, 'shared_converting', None)
+        shared = ['shared_converting']
+        first = self.context(shared_modules=shared)
+        second = self.context(shared_modules=shared)
+        # as when executing instructions for each context in turn
+        for context in [first, second]:
+            token = converters.use_registered_converters(context.converters)
+            try:
+                module = context.get_module('shared_converting')
+                self.assertTrue(module is sys.modules['shared_converting'])
+                self.assertEqual(converters.to_string(module.Money()), 
+                                 'money')
+            finally:
+                converters.stop_using_converters(token)
+        money = sys.modules['shared_converting'].Money()
+        self.assertEqual(converters.to_string(money), 'money')
+
+    def test_modules_are_viewed_not_copied(self):
+        context = self.context()
+        empty = context.memory_usage()
+        self.assertEqual(len(context._modules.maps[0]), 0)
+        self.assertTrue(context._modules['json'] is json)
+        context.get_module('isolated_fixture')
+        self.assertEqual(sorted(context._modules.maps[0]), 
+                         ['isolated_fixture', 'isolated_helper', 
+                          'isolated_pkg', 'isolated_pkg.sub'])
+        usage = context.memory_usage()
+        self.assertTrue(usage['module namespaces'] > 0)
+        self.assertEqual(empty['module namespaces'], 0)
+        self.assertEqual(usage['total'], sum(value for name, value 
+                                             in usage.items() 
+                                             if name != 'total'))
+
+    def test_unisolated_imports_use_context_path(self):
+        sys_path = list(sys.path)
+        self.addCleanup(sys.modules.pop, 'isolated_helper', None)
+        module = self.context(False).get_module('isolated_helper')
+        self.assertTrue(sys.modules['isolated_helper'] is module)
+        self.assertEqual(sys.path, sys_path)
+        self.assertEqual(execution.ExecutionContext().get_module(
+            'isolated_helper_missing'), None)
+
+
+class UnpackTestCase(unittest.TestCase):
+    def test_unpack_nested_chunks(self):
+        item_list = [['id_0', 'call', 'echoer', 'echo', ['a', ['b', '']]],
+                     'plain', '[not a chunk]']
+        self.assertEqual(protocol.unpack(protocol.pack(item_list)),
+                         item_list)
+
+    def test_unpack_malformed_raises_unpacking_error(self):
+        for malformed in ['[000001:000003:abc]',
+                          '[000001:00000x:abc:]',
+                          '[000002:000003:abc:]',
+                          '[000001:000009:abc:]']:
+            self.assertRaises(protocol.UnpackingError,
+                              protocol.unpack, malformed)
+
+
+class ChunkTestCase(unittest.TestCase):
+    table = [['r0c0', 'r0c1'], ['r1c0', '$V'], ['r2c0', 'r2c1']]
+
+    def unpack_table(self):
+        message = protocol.pack([['id_0', 'call', 'x', 'table', self.table]])
+        instruction = protocol.unpack(message, eager_depth=2)[0]
+        self.assertEqual(instruction[:4], ['id_0', 'call', 'x', 'table'])
+        return instruction[4]
+
+    def test_lazy_table_argument(self):
+        chunk = self.unpack_table()
+        self.assertTrue(isinstance(chunk, protocol.Chunk))
+        self.assertEqual(len(chunk), 3)
+        self.assertEqual(chunk[1][0], 'r1c0')
+        self.assertEqual(chunk[-1], ('r2c0', 'r2c1'))
+        self.assertEqual(chunk[1:], (('r1c0', '$V'), ('r2c0', 'r2c1')))
+        self.assertEqual([row[1] for row in chunk], ['r0c1', '$V', 'r2c1'])
+        self.assertEqual(chunk, self.table)
+        self.assertRaises(IndexError, chunk.__getitem__, 3)
+
+    def test_symbols_are_substituted_on_access(self):
+        context = execution.ExecutionContext()
+        context.store_symbol('V', 'value')
+        args = context.to_args([self.unpack_table()], 0)
+        self.assertEqual(args[0][1], ('r1c0', 'value'))
+
+    def test_malformed_chunk_fails_on_access(self):
+        chunk = protocol.Chunk('[000002:000001:a:]', 0, 18)
+        self.assertRaises(protocol.UnpackingError, len, chunk)
+
+    def test_returned_chunks_are_packed_as_lists(self):
+        context = execution.ExecutionContext()
+        context.store_instance('x', _EchoTableFixture())
+        message = protocol.pack([['id_0', 'call', 'x', 'doTable', self.table],
+                                 ['id_1', 'call', 'x', 'row', self.table]])
+        results = execution.Results()
+        execution.Instructions(protocol.unpack(message, eager_depth=2)
+                               ).execute(context, results)
+        self.assertEqual(protocol.unpack(results.packed()),
+                         [['id_0', self.table], ['id_1', self.table[2]]])
+        self.assertEqual(converters.to_string(collections.UserString('ab')),
+                         'ab')
+
+
+class _EchoTableFixture(object):
+    def do_table(self, rows):
+        return rows
+
+    def row(self, rows):
+        return rows[2]
+
+
+class _TableFixture(object):
+    @converters.convert_arg(to_type=converters.Table)
+    def table(self, table):
+        return table
+
+
+class ConverterDispatchTestCase(unittest.TestCase):
+    def test_values_use_converters_of_base_types(self):
+        class Number(enum.IntEnum):
+            ONE = 1
+        class Date(datetime.date):
+            pass
+        class Fraction(float, enum.Enum):
+            HALF = 0.5
+        self.assertEqual(converters.to_string(Number.ONE), '1')
+        self.assertEqual(converters.to_string(Fraction.HALF), '0.5')
+        self.assertEqual(converters.to_string(collections.OrderedDict()), 
+                         converters.to_string({}))
+        self.assertEqual(converters.to_string(Date(2010, 1, 2)), 
+                         '2010-01-02')
+        self.assertEqual(converters.to_string(True), 'true')
+
+    def test_types_use_exact_converters(self):
+        class Number(enum.IntEnum):
+            ONE = 1
+        self.assertTrue(converters.converter_for(Number) 
+                        is converters.converter_for(object))
+
+    def test_registration_invalidates_dispatch(self):
+        class Text(str):
+            pass
+        self.assertEqual(converters.to_string(Text('x')), 'x')
+        converter = converters.StrConverter()
+        converter.to_string = lambda value: 'text'
+        converters.register_converter(Text, converter)
+        self.assertEqual(converters.to_string(Text('x')), 'text')
+
+
+class _Marked(object):
+    pass
+
+
+class _MarkedConverter(converters.Converter):
+    def to_string(self, value):
+        return 'marked'
+
+
+class ConverterRegistryTestCase(unittest.TestCase):
+    def execute_registration(self, context):
+        results = execution.Results()
+        converter = _MarkedConverter()
+        register = lambda: converters.register_converter(_Marked, converter)
+        instruction = instructions.Instruction('1', ['x'])
+        instruction.execute = lambda context, results: (
+            register(), results.completed(instruction, _Marked()))
+        execution.Instructions([[]], lambda item: instruction).execute(
+            context, results)
+        return results.collection()[0][1]
+
+    def test_isolated_contexts_register_in_an_overlay(self):
+        context = execution.ExecutionContext(isolate_imports=True)
+        self.assertEqual(self.execute_registration(context), 'marked')
+        self.assertNotEqual(converters.to_string(_Marked()), 'marked')
+        self.assertTrue(context.converters.lookup(int) 
+                        is converters.converter_for(int))
+
+    def test_registrations_are_seen_across_threads(self):
+        context = execution.ExecutionContext()
+        self.assertTrue(context.converters 
+                        is converters.registered_converters())
+        converter = _MarkedConverter()
+        thread = threading.Thread(target=converters.register_converter,
+                                  args=(_Marked, converter))
+        thread.start()
+        thread.join()
+        self.addCleanup(converters.registered_converters().register, 
+                        _Marked, converters.Converter())
+        self.assertEqual(converters.to_string(_Marked()), 'marked')
+        overlay = converters.isolated_converters()
+        self.assertTrue(overlay.for_value_type(_Marked) is converter)
+
+
+class DatetimeConvertersTestCase(unittest.TestCase):
+    def test_iso_format_with_strptime_fallback(self):
+        self.assertEqual(converters.DateConverter().from_string('2009-2-8'),
+                         datetime.date(2009, 2, 8))
+        self.assertEqual(converters.TimeConverter().from_string('1:2:3.4'),
+                         datetime.time(1, 2, 3, 400000))
+        self.assertEqual(converters.DatetimeConverter().from_string(
+            '2009-02-28 21:54:32+01:00'), datetime.datetime(2009, 2, 28, 21, 
+            54, 32, tzinfo=datetime.timezone(datetime.timedelta(hours=1))))
+        self.assertRaises(ValueError, 
+                          converters.DateConverter().from_string, 'bad')
+
+    def test_from_strings(self):
+        self.assertEqual(converters.from_strings(['2009-02-28', '2009-3-1'], 
+                                                 datetime.date),
+                         [datetime.date(2009, 2, 28), 
+                          datetime.date(2009, 3, 1)])
+        self.assertEqual(converters.TimeConverter().from_strings(['01:02:03']),
+                         [datetime.time(1, 2, 3)])
+
+    def test_to_string(self):
+        value = datetime.datetime(2009, 1, 2, 3, 4, 5, 6)
+        self.assertEqual(converters.to_string(value), str(value))
+        self.assertEqual(converters.to_string(value.date()), '2009-01-02')
+        self.assertEqual(converters.to_string(value.time()), 
+                         '03:04:05.000006')
+
+
+class ConversionPlanTestCase(unittest.TestCase):
+    def test_single_and_tuple_strategies(self):
+        @converters.convert_arg(to_type=int)
+        def ints(self, *args):
+            return args
+        self.assertEqual(ints(None, '1', '2', '3'), (1, 2, 3))
+        @converters.convert_arg(to_type=(int, float))
+        def mixed(self, *args):
+            return args
+        self.assertEqual(mixed(None, '1', '2'), (1, 2.0))
+        self.assertEqual(mixed(None, '1'), (1,))
+        self.assertRaises(WaferSlimException, mixed, None, '1', '2', '3')
+
+    def test_annotated_params(self):
+        @converters.convert_arg()
+        def annotated(self, an_int: int, a_table: converters.Table, 
+                      a_str, *floats: float):
+            return an_int, a_table.column(0), a_str, floats
+        self.assertEqual(annotated(None, '1', [['2'], ['3']], '4', '5', '6'),
+                         (1, ['3'], '4', (5.0, 6.0)))
+
+    def test_string_annotations(self):
+        @converters.convert_arg()
+        def annotated(self, an_int: 'int', a_date: 'datetime.date'):
+            return an_int, a_date
+        self.assertEqual(annotated(None, '1', '2009-02-28'),
+                         (1, datetime.date(2009, 2, 28)))
+
+    def test_plans_follow_the_converters_in_use(self):
+        class _Prefixed(object):
+            pass
+        class _PrefixedConverter(converters.Converter):
+            def __init__(self, prefix):
+                self.prefix = prefix
+            def from_string(self, value):
+                return self.prefix + value
+        converters.register_converter(_Prefixed, _PrefixedConverter('a'))
+        @converters.convert_arg(to_type=_Prefixed)
+        def prefixed(self, value):
+            return value
+        self.assertEqual(prefixed(None, 'x'), 'ax')
+        overlay = converters.isolated_converters()
+        token = converters.use_registered_converters(overlay)
+        try:
+            self.assertEqual(prefixed(None, 'x'), 'ax')
+            overlay.register(_Prefixed, _PrefixedConverter('b'))
+            self.assertEqual(prefixed(None, 'x'), 'bx')
+        finally:
+            converters.stop_using_converters(token)
+        self.assertEqual(prefixed(None, 'x'), 'ax')
+        converters.register_converter(_Prefixed, _PrefixedConverter('c'))
+        self.assertEqual(prefixed(None, 'x'), 'cx')
+
+    def test_plans_are_compiled_once_per_converters(self):
+        compiled = []
+        plans = converters._Plans(lambda: compiled.append(1) or len(compiled))
+        overlay = converters.isolated_converters()
+        process = converters.process_converters()
+        for converters_in_use in [overlay, process, overlay, process]:
+            plans.use(converters_in_use)
+        self.assertEqual(len(compiled), 2)
+        # registering anywhere may change any plan
+        converters.isolated_converters().register(int, converters.Converter())
+        self.assertEqual(plans.use(overlay), 
+                         (overlay, overlay.generation, 3))
+
+    def test_iterable_converter(self):
+        converter = converters.IterableConverter(to_type=(str, int))
+        self.assertEqual(converter.from_string('[a, 1]'), ('a', 1))
+        self.assertRaises(WaferSlimException, converter.from_string, 'a,1,2')
+        self.assertEqual(converters.IterableConverter(to_type=int
+                                                      ).from_string('1,2,3'),
+                         (1, 2, 3))
+
+    def test_plan_is_shared_safely_between_threads(self):
+        @converters.convert_arg(to_type=(int, float, str))
+        def mixed(self, *args):
+            return args
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda i: mixed(None, str(i), '1', 
+                                                        'x'), range(200)))
+        self.assertEqual(results, [(i, 1.0, 'x') for i in range(200)])
+
+
+class MemoizingConverterTestCase(unittest.TestCase):
+    def test_hits_and_misses(self):
+        converter = converters.MemoizingConverter(
+                        converters.FromConstructorConverter(int), maxsize=2)
+        self.assertEqual(converter.from_strings(['0', '10', '0', '0']), 
+                         [0, 10, 0, 0])
+        self.assertEqual(converter.from_string('3'), 3)
+        info = converter.cache_info()
+        self.assertEqual((info.hits, info.misses, info.maxsize, info.currsize),
+                         (2, 3, 2, 2))
+        self.assertEqual(converter.to_string(10), '10')
+        converter.cache_clear()
+        self.assertEqual(converter.cache_info().currsize, 0)
+
+    def test_memoize_converters(self):
+        token = converters.use_registered_converters(
+                    converters.isolated_converters())
+        try:
+            caches = converters.memoize_converters(16)
+            self.assertEqual(converters.memoize_converters(16), caches)
+            @converters.convert_arg(to_type=(datetime.date, bool))
+            def method(self, *args):
+                return args
+            self.assertEqual(method(None, '2009-02-28', 'true'), 
+                             (datetime.date(2009, 2, 28), True))
+            self.assertEqual(method(None, '2009-02-28', 'false'), 
+                             (datetime.date(2009, 2, 28), False))
+            self.assertEqual(caches[datetime.date].cache_info().hits, 1)
+            self.assertEqual(caches[bool].cache_info().misses, 2)
+        finally:
+            converters.stop_using_converters(token)
+        self.assertFalse(isinstance(converters.converter_for(int), 
+                                    converters.MemoizingConverter))
+
+
+class TableTestCase(unittest.TestCase):
+    rows = [['cash', 'credit', 'cash'], ['0', 'true', 'x'], ['10', '']]
+
+    def test_rows_and_columns(self):
+        table = _TableFixture().table(self.rows)
+        self.assertEqual(table.header(), ('cash', 'credit', 'cash'))
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table[1], ['10', ''])
+        self.assertEqual(list(table), self.rows[1:])
+        self.assertEqual(table.column('cash'), ['0', '10'])
+        self.assertEqual(table.column(2), ['x', None])
+        self.assertRaises(KeyError, table.column, 'missing')
+
+    def test_columns_are_converted_in_bulk(self):
+        table = converters.Table(self.rows)
+        self.assertEqual(table.column('cash', to_type=int), [0, 10])
+        self.assertEqual(table.column('credit', to_type=bool), [True, False])
+        self.assertTrue(table.column('cash', to_type=int)
+                        is table.column('cash', to_type=int))
+
+    def test_empty_tables(self):
+        for header_row in (True, False):
+            table = converters.Table([], header_row)
+            self.assertEqual(table.header(), ())
+            self.assertEqual(len(table), 0)
+            self.assertEqual(list(table), [])
+            self.assertEqual(table[:], [])
+            self.assertRaises(IndexError, table.__getitem__, 0)
+        table = converters.Table([['cash']])
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.column('cash', to_type=int), [])
+
+    def test_slices(self):
+        table = converters.Table(self.rows)
+        self.assertEqual(table[:], self.rows[1:])
+        self.assertEqual(table[1:], [['10', '']])
+        self.assertEqual(table[::-1], self.rows[:0:-1])
+        self.assertEqual(table[5:], [])
+        table = converters.Table(self.rows, header_row=False)
+        self.assertEqual(table[-2:], self.rows[-2:])
+
+    def test_without_header_row(self):
+        converter = converters.TableConverter(header_row=False)
+        table = converter.from_string(self.rows)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.column(0, to_type=str), ['cash', '0', '10'])
+
+
+class _Counted(object):
+    lookups = 0
+
+    def __getattr__(self, name):
+        _Counted.lookups += 1
+        raise AttributeError(name)
+
+
+class ParamsConverterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.context.store_symbol('a', 'A')
+        self.context.store_symbol('b_1', 'B')
+        self.converter = execution.ParamsConverter(self.context)
+
+    def test_symbol_free_params_are_untouched(self):
+        param = ''.join(['no symbols'])
+        self.assertTrue(self.converter.to_args([param], 0)[0] is param)
+        self.assertFalse(param in execution.ParamsConverter._SEGMENTS)
+
+    def test_symbols_are_substituted(self):
+        self.assertEqual(self.converter.to_args(
+            ['$a$b_1', 'x$1', '$unknown-$a', ['$a', ['$b_1']]], 0),
+            ('AB', 'x$1', '$unknown-A', ('A', ('B',))))
+
+    def test_all_symbols_are_substituted(self):
+        self.assertEqual(self.converter.to_args([' '.join(['$a'] * 20)], 0),
+                         (' '.join(['A'] * 20),))
+
+    def test_param_shapes_are_memoised(self):
+        self.converter.to_args(['<$a>'], 0)
+        self.context.store_symbol('a', 'changed')
+        self.assertEqual(execution.ParamsConverter._SEGMENTS['<$a>'],
+                         ('<', 'a', '>'))
+        self.assertEqual(self.converter.to_args(['<$a>'], 0), ('<changed>',))
+
+
+class TypedSymbolsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext(typed_symbols=True)
+        self.value = [1, 2, 3]
+        self.context.store_symbol('list', self.value)
+        self.converter = execution.ParamsConverter(self.context)
+
+    def test_whole_arg_symbols_keep_their_values(self):
+        self.assertTrue(self.converter.to_args(['$list'], 0)[0] 
+                        is self.value)
+
+    def test_interpolated_symbols_are_stringified_once(self):
+        self.context.store_symbol('int', 42)
+        self.assertEqual(self.converter.to_args(['<$int>', '$int$int'], 0),
+                         ('<42>', '4242'))
+        self.context._symbols['int'] = 0
+        self.assertEqual(self.context.get_symbol('int'), '42')
+        self.context.store_symbol('int', 7)
+        self.assertEqual(self.context.get_symbol('int'), '7')
+
+    def test_untyped_symbols_are_strings(self):
+        context = execution.ExecutionContext()
+        context.store_symbol('int', 1)
+        self.assertEqual(context.get_symbol_value('int'), '1')
+        self.assertEqual(context.get_symbol_value('missing'), '$missing')
+
+    def test_convert_arg_passes_typed_values_through(self):
+        @converters.convert_arg(to_type=int)
+        def method(self, *args):
+            return args
+        self.assertEqual(method(None, '1', self.value), (1, self.value))
+        self.assertEqual(method.__name__, 'method')
+        table = converters.convert_arg(using=converters.TableConverter())(
+            lambda self, rows: rows)
+        self.assertEqual(table(None, [['a'], ['1']]).column('a'), ['1'])
+
+
+class TargetResolutionTestCase(unittest.TestCase):
+    def execute(self, context, *instruction_list):
+        results = execution.Results()
+        for instruction in instruction_list:
+            instruction.execute(context, results)
+        return results.collection()
+
+    def test_direct_sut_and_library_targets(self):
+        context = execution.ExecutionContext()
+        module = 'waferslim.examples.%s'
+        self.assertEqual(self.execute(
+            context,
+            instructions.Make('m_0', ['driver', module % 'system_under_test'
+                                      + '.SlimDriverWithSutField']),
+            instructions.Make('m_1', ['library_0', module % 'library'
+                                      + '.FileSupport']),
+            instructions.Call('c_0', ['driver', 'init']),
+            instructions.Call('c_1', ['driver', 'createPerson', 'Ben']),
+            instructions.Call('c_2', ['driver', 'exists', 'Ben']),
+            instructions.Call('c_3', ['driver', 'delete', '/tmp']),
+            instructions.Call('c_4', ['driver', 'missing'])),
+            [['m_0', 'OK'], ['m_1', 'OK'], ['c_0', '/__VOID__/'],
+             ['c_1', '/__VOID__/'], ['c_2', 'true'], ['c_3', '/__VOID__/'],
+             ['c_4', '__EXCEPTION__: message:<<NO_METHOD_IN_CLASS missing '
+                     'SlimDriverWithSutField>>']])
+
+    def test_methods_found_after_instance_changes(self):
+        context = execution.ExecutionContext()
+        module = 'waferslim.examples.system_under_test'
+        not_found = ('__EXCEPTION__: message:<<NO_METHOD_IN_CLASS exists '
+                     'SlimDriverWithSutField>>')
+        self.assertEqual(self.execute(
+            context,
+            instructions.Make('m_0', ['driver', module 
+                                      + '.SlimDriverWithSutField']),
+            instructions.Call('c_0', ['driver', 'exists', 'Ben']),
+            instructions.Call('c_1', ['driver', 'init']),
+            instructions.Call('c_2', ['driver', 'createPerson', 'Ben']),
+            instructions.Call('c_3', ['driver', 'exists', 'Ben'])),
+            [['m_0', 'OK'], ['c_0', not_found], ['c_1', '/__VOID__/'],
+             ['c_2', '/__VOID__/'], ['c_3', 'true']])
+        fixture = echo_fixture.EchoFixture()
+        self.assertEqual(context.get_target(fixture, 'aB'), None)
+        fixture.a_b = len
+        self.assertTrue(context.get_target(fixture, 'aB') is len)
+
+    def test_resolution_is_cached_until_instances_change(self):
+        context = execution.ExecutionContext()
+        context.store_instance('counted', _Counted())
+        for i in range(10):
+            self.assertEqual(
+                context.get_target(context.get_instance('counted'), 'aB'),
+                None)
+        lookups = _Counted.lookups
+        self.assertTrue(0 < lookups <= 4)
+        context.store_instance('other', object())
+        context.get_target(context.get_instance('counted'), 'aB')
+        self.assertTrue(_Counted.lookups > lookups)
+
+
+class _Instruction(object):
+    def __init__(self, instruction_id):
+        self._id = instruction_id
+
+    def instruction_id(self):
+        return self._id
+
+
+class _Incomparable(object):
+    def __eq__(self, other):
+        raise ValueError('ambiguous comparison')
+
+    def __str__(self):
+        return 'incomparable'
+
+
+class _RowsFixture(object):
+    def __init__(self):
+        self.batches = []
+
+    def execute_rows(self, rows):
+        self.batches.append(rows)
+        return [[None] * (len(row) - 1) + [row[1][1][0]] for row in rows]
+
+
+class _Unconvertible(object):
+    def __str__(self):
+        raise ValueError('unconvertible')
+
+
+class _ProbedFixture(object):
+    def __init__(self):
+        self.probes = 0
+
+    def __getattr__(self, name):
+        if name == 'execute_rows':
+            self.probes += 1
+        raise AttributeError(name)
+
+    def echo(self, value):
+        return value
+
+
+class DecisionRowsTestCase(unittest.TestCase):
+    def table(self, rows):
+        unpacked = [['m', 'make', 'dt', 'Fixture'],
+                    ['t', 'call', 'dt', 'table', []]]
+        for row, value in enumerate(rows):
+            unpacked.extend([['%s_r' % row, 'call', 'dt', 'reset'],
+                             ['%s_s' % row, 'call', 'dt', 'setX', value],
+                             ['%s_e' % row, 'call', 'dt', 'execute'],
+                             ['%s_g' % row, 'call', 'dt', 'x']])
+        return unpacked[1:]
+
+    def execute(self, fixture, unpacked):
+        context = execution.ExecutionContext()
+        context.store_instance('dt', fixture)
+        results = execution.Results()
+        execution.Instructions(unpacked).execute(context, results)
+        return dict(results.collection())
+
+    def test_rows_are_executed_together(self):
+        fixture = _RowsFixture()
+        results = self.execute(fixture, self.table(['a', 'b']))
+        self.assertEqual(fixture.batches, [[
+            [('reset', ()), ('setX', ('a',)), ('execute', ()), ('x', ())],
+            [('reset', ()), ('setX', ('b',)), ('execute', ()), ('x', ())]]])
+        self.assertEqual(results['0_g'], 'a')
+        self.assertEqual(results['1_g'], 'b')
+        self.assertEqual(results['1_s'], '/__VOID__/')
+        self.assertEqual(len(results), 9)
+
+    def test_partial_rows_are_executed_separately(self):
+        fixture = _RowsFixture()
+        unpacked = self.table(['a'])[:-2]
+        unpacked.append(['1_r', 'call', 'dt', 'reset'])
+        results = self.execute(fixture, unpacked)
+        self.assertEqual(fixture.batches, [])
+        self.assertTrue(results['1_r'].startswith('__EXCEPTION__'))
+
+    def test_unconvertible_results_fail_their_cells(self):
+        fixture = _RowsFixture()
+        fixture.execute_rows = lambda rows: [
+            [None, None, None, row[1][1][0] == 'b' and _Unconvertible() or 1] 
+            for row in rows]
+        results = self.execute(fixture, self.table(['a', 'b', 'c']))
+        self.assertEqual(len(results), 13)
+        self.assertEqual(results['0_g'], '1')
+        self.assertEqual(results['1_g'], 
+                         '__EXCEPTION__: message:<<unconvertible>>')
+        self.assertEqual(results['2_g'], '1')
+
+    def test_instances_are_probed_for_execute_rows_once(self):
+        fixture = _ProbedFixture()
+        calls = lambda: [['%s' % i, 'call', 'p', 'echo', 'x'] 
+                         for i in range(5)]
+        context = execution.ExecutionContext()
+        context.store_instance('p', fixture)
+        execution.Instructions(calls() + [['u', 'unknown']] + calls()
+                               ).execute(context, execution.Results())
+        self.assertEqual(fixture.probes, 2)
+
+    def test_mismatched_results_fail_every_row(self):
+        fixture = _RowsFixture()
+        fixture.execute_rows = lambda rows: [[]]
+        results = self.execute(fixture, self.table(['a', 'b']))
+        self.assertEqual(len([result for result in results.values() 
+                              if 'execute_rows()' in result]), 8)
+
+
+class _Meeting(object):
+    barrier = None
+
+    def meet(self):
+        return self.barrier.wait(5) is not None
+
+    def value(self, value):
+        return value
+
+
+class ParallelInstructionsTestCase(unittest.TestCase):
+    def setUp(self):
+        _Meeting.barrier = threading.Barrier(2)
+        self.context = execution.ExecutionContext()
+        self.context.store_instance('a', _Meeting())
+        self.context.store_instance('b', _Meeting())
+
+    def execute(self, unpacked, instructions=execution.ParallelInstructions):
+        results = execution.Results()
+        instructions(unpacked).execute(self.context, results)
+        return results.collection()
+
+    def test_independent_instructions_run_concurrently(self):
+        self.assertEqual(self.execute([['1', 'call', 'a', 'meet'],
+                                       ['2', 'call', 'b', 'meet']]),
+                         [['1', 'true'], ['2', 'true']])
+
+    def test_results_are_in_the_original_order(self):
+        unpacked = [['1', 'callAndAssign', 's', 'a', 'value', 'x'],
+                    ['2', 'call', 'b', 'value', 'y'],
+                    ['3', 'call', 'b', 'value', '<$s>'],
+                    ['4', 'import', 'some.module'],
+                    ['5', 'call', 'a', 'value', '$s'],
+                    ['6', 'call', 'c', 'value']]
+        self.assertEqual(self.execute([list(item) for item in unpacked]),
+                         self.execute(unpacked, execution.Instructions))
+
+    def test_groups(self):
+        unpacked = [['1', 'call', 'a', 'value', '$s'],
+                    ['2', 'call', 'b', 'value'],
+                    ['3', 'callAndAssign', 's', 'c', 'value'],
+                    ['4', 'make', 'libraryX', 'Fixture'],
+                    ['5', 'call', 'b', 'value'],
+                    ['6', 'call', 'c', 'value']]
+        self.assertEqual(self.schedule(unpacked), 
+                         [[[0, 2], [1]], [[3]], [[4], [5]]])
+
+    def test_calls_that_may_fall_back_are_grouped(self):
+        unpacked = [['1', 'call', 'a', 'value'],
+                    ['2', 'call', 'b', 'value'],
+                    ['3', 'call', 'c', 'value'],
+                    ['4', 'call', 'a', 'libraryMethod'],
+                    ['5', 'make', 'd', 'Fixture'],
+                    ['6', 'call', 'd', 'value']]
+        self.assertEqual(self.schedule(unpacked), [[[0, 2, 3, 4, 5], [1]]])
+
+    def schedule(self, unpacked):
+        instructions = [execution.instruction_for(item) for item in unpacked]
+        return list(execution._schedule(instructions, 
+                                        self.context.symbols_in,
+                                        self.context.may_fall_back))
+
+    def test_stop_test_discards_later_results(self):
+        unpacked = [['1', 'call', 'a', 'value', 'x'],
+                    ['2', 'call', 'b', 'value', 'x'],
+                    ['3', 'call', 'a', 'stop'],
+                    ['4', 'call', 'b', 'value', 'x'],
+                    ['5', 'import', 'some.module']]
+        _Meeting.stop = lambda self: _raise(StopTestException('stop'))
+        self.addCleanup(delattr, _Meeting, 'stop')
+        results = self.execute(unpacked)
+        self.assertEqual([result[0] for result in results], ['1', '2', '3'])
+        self.assertTrue(results[-1][1].startswith('__EXCEPTION__:ABORT'))
+
+    def test_stop_test_cancels_pending_groups(self):
+        unpacked = [['1', 'call', 'a', 'value', 'x'],
+                    ['2', 'call', 'b', 'record'],
+                    ['3', 'call', 'a', 'stop'],
+                    ['4', 'call', 'b', 'record']]
+        _Meeting.stop = lambda self: _raise(StopTestException('stop'))
+        self.addCleanup(delattr, _Meeting, 'stop')
+        recorded = []
+        self.context.get_instance('b').record = lambda: recorded.append(1)
+        def one_worker(unpacked):
+            instructions = execution.ParallelInstructions(unpacked)
+            instructions.max_workers = 1
+            return instructions
+        results = self.execute(unpacked, one_worker)
+        self.assertEqual([result[0] for result in results], ['1', '3'])
+        self.assertEqual(recorded, [])
+
+
+def _raise(error):
+    raise error
+
+
+class _AsyncFixture(object):
+    def __init__(self, mine, theirs):
+        self.mine, self.theirs = mine, theirs
+
+    async def meet(self):
+        self.mine.set()
+        await asyncio.wait_for(self.theirs.wait(), 5)
+        return threading.current_thread().name
+
+
+async def _new_events(count):
+    # events made on the running loop, as asyncio needs before python 3.10
+    return [asyncio.Event() for _ in range(count)]
+
+
+class AsyncFixturesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.addCleanup(self.context.close)
+        first, second = self.context.run_awaitable(_new_events(2))
+        self.context.store_instance('a', _AsyncFixture(first, second))
+        self.context.store_instance('b', _AsyncFixture(second, first))
+
+    def test_awaitables_run_on_the_context_loop(self):
+        results = execution.Results()
+        execution.ParallelInstructions([['1', 'call', 'a', 'meet'], 
+                                        ['2', 'call', 'b', 'meet']]
+                                       ).execute(self.context, results)
+        (_, first), (_, second) = results.collection()
+        self.assertEqual(first, second)
+        self.assertTrue('event loop' in first)
+
+    def test_close_stops_the_loop(self):
+        loop = self.context._get_event_loop()
+        thread = self.context._event_loop_thread
+        self.context.close()
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(loop.is_closed())
+
+
+class _Offloaded(object):
+    def __init__(self):
+        self.offset = 1
+
+    @offload.offload
+    @converters.convert_arg(to_type=int)
+    def add(self, value):
+        value, self.offset = value + self.offset, None
+        return os.getpid(), value
+
+    @offload.offload
+    @converters.convert_arg(to_type=converters.Table)
+    def do_table(self, table):
+        return [[cell.upper() for cell in row] for row in table.rows()]
+
+
+class _SlottedOffloaded(object):
+    __slots__ = ('offset', '__scale')
+
+    def __init__(self):
+        self.offset, self.__scale = 1, 2
+
+    @offload.offload
+    @converters.convert_arg(to_type=int)
+    def add(self, value):
+        return value * self.__scale + self.offset
+
+
+class OffloadTestCase(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        offload.shutdown()
+
+    def test_method_runs_converted_in_worker(self):
+        fixture = _Offloaded()
+        pid, value = fixture.add('41')
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(value, 42)
+        self.assertEqual(fixture.offset, 1)
+        self.assertEqual(fixture.add.__name__, 'add')
+
+    def test_slotted_instances_are_copied(self):
+        self.assertEqual(_SlottedOffloaded().add('20'), 41)
+
+    def test_table_method_runs_in_worker(self):
+        context = execution.ExecutionContext()
+        context.store_symbol('V', 'value')
+        context.store_instance('offloaded', _Offloaded())
+        message = protocol.pack([['id_0', 'call', 'offloaded', 'doTable',
+                                  [['a', '$V'], ['b', 'c']]]])
+        results = execution.Results()
+        execution.Instructions(protocol.unpack(message, eager_depth=2)
+                               ).execute(context, results)
+        self.assertEqual(results.collection(), 
+                         [['id_0', [['A', 'VALUE'], ['B', 'C']]]])
+
+
+class _Unrepresentable(object):
+    def __repr__(self):
+        raise AssertionError('repr() should not be called')
+
+
+class LogsTestCase(unittest.TestCase):
+    def test_values_are_only_formatted_when_logged(self):
+        logger = logging.getLogger('LogsTestCase')
+        logger.setLevel(logging.INFO)
+        logs.debug(logger, 'value: %r', _Unrepresentable())
+        execution._debug(logger, 'value: %r', _Unrepresentable())
+
+    def test_lazy_values_are_only_made_when_logged(self):
+        logger = logging.getLogger('LogsTestCase')
+        logger.setLevel(logging.INFO)
+        logs.debug(logger, 'value: %s', 
+                   logs.Lazy(lambda: self.fail('value made')))
+        self.assertEqual(str(logs.Abbreviated(logs.Lazy(lambda: [1]))), '[1]')
+
+    def test_values_are_abbreviated(self):
+        self.assertEqual(str(logs.Abbreviated('short')), 'short')
+        long_str = 'x' * (logs.MAX_LENGTH + 1)
+        self.assertEqual(str(logs.Abbreviated(long_str)), 
+                         '%s...(%s chars)' % (long_str[:-1], len(long_str)))
+        self.assertTrue(len(repr(logs.Abbreviated(list(range(10000))))) 
+                        < logs.MAX_LENGTH)
+
+    def test_repeated_events_are_rate_limited(self):
+        limiter = logs.RateLimiter(interval=60)
+        self.assertEqual(limiter.allow('a'), 0)
+        self.assertEqual(limiter.allow('a'), None)
+        self.assertEqual(limiter.allow('b'), 0)
+        limiter = logs.RateLimiter(interval=0)
+        limiter.allow('a')
+        self.assertEqual(limiter.allow('a'), 0)
+
+    def test_repeated_failures_are_logged_once(self):
+        logger = logging.getLogger('Instructions')
+        with self.assertLogs(logger, logging.WARNING) as logged:
+            execution.Instructions([['%s' % i, 'call', 'x', 'y'] for i in 
+                                    range(3)], _BadInstruction).execute(
+                execution.ExecutionContext(), execution.Results())
+            logger.warning('done')
+        self.assertEqual(len(logged.records), 2)
+
+
+def _BadInstruction(params):
+    instruction = instructions.Instruction(params[0], params)
+    instruction.execute = lambda context, results: _raise(
+        ValueError('LogsTestCase'))
+    return instruction
+
+
+class ResultsTestCase(unittest.TestCase):
+    def test_results_are_packed_as_collected(self):
+        results = execution.Results()
+        results.completed(_Instruction('id_0'))
+        results.completed(_Instruction('id_1'), _Incomparable())
+        results.completed(_Instruction('id_2'), ['a', 'b'])
+        self.assertEqual(
+            results.packed(),
+            protocol.pack([['id_0', 'OK'], ['id_1', 'incomparable'],
+                           ['id_2', ['a', 'b']]]))
+        self.assertEqual(results.collection()[2], ['id_2', ['a', 'b']])
+        results.collection()[2][1].append('c')
+        self.assertEqual(results.collection(), 
+                         protocol.unpack(results.packed()))
+
+    def test_results_stay_in_order_when_joined_and_merged(self):
+        results = execution.Results()
+        expected = []
+        for i in range(600):
+            collecting = i % 3 and results or results.fork()
+            collecting.completed(_Instruction('id_%s' % i), str(i))
+            if collecting is not results:
+                results.merge(collecting)
+            expected.append(['id_%s' % i, str(i)])
+        self.assertEqual(results.collection(), expected)
+        self.assertEqual(results.packed(), protocol.pack(expected))
+
+    def test_unencodable_result_is_not_collected(self):
+        results = execution.Results(convert_to_string=lambda value: value)
+        self.assertRaises(TypeError, results.completed,
+                          _Instruction('id_0'), 1)
+        results.failed(_Instruction('id_0'), 'cause')
+        self.assertEqual(results.collection(),
+                         [['id_0', '__EXCEPTION__: message:<<cause>>']])
+
+
+class _FakeSocket(object):
+    def __init__(self, data, max_recv=3):
+        self.data, self.pos, self.max_recv = data, 0, max_recv
+        self.sent = []
+
+    def recv_into(self, view):
+        size = min(len(view), self.max_recv, len(self.data) - self.pos)
+        view[:size] = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def sendmsg(self, buffers):
+        # Deliberately send only part of what was asked for
+        data = b''.join(bytes(buffer) for buffer in buffers)[:self.max_recv]
+        self.sent.append(data)
+        return len(data)
+
+
+class MessageReaderTestCase(unittest.TestCase):
+    messages = [protocol.pack(['a', '\u00e9\u20ac']), 'bye']
+
+    def read_all(self, length_of, messages=None):
+        messages = messages or self.messages
+        data = b''.join(
+            ('%06d:' % length_of(message)).encode('utf-8')
+            + message.encode('utf-8') for message in messages)
+        reader = protocol.MessageReader(_FakeSocket(data), read_size=4)
+        received = [reader.read_message(reader.read_length())
+                    for message in messages]
+        self.assertEqual(reader.bytes_read, len(data))
+        return received
+
+    def test_byte_length_headers(self):
+        self.assertEqual(
+            self.read_all(lambda message: len(message.encode('utf-8'))),
+            self.messages)
+
+    def test_character_length_headers(self):
+        self.assertEqual(self.read_all(len), self.messages)
+
+    def test_character_lengths_cut_off_after_a_nested_chunk(self):
+        byte_length = lambda message: len(message.encode('utf-8'))
+        for payload in ['\u00e9', '\u20ac', '\u00e9\u00e9', '\u20ac\u00e9', 
+                        '\u20ac\u20ac', '\U0001f600']:
+            messages = [protocol.pack([['a', [payload]]]), 
+                        protocol.pack([[payload], 'b']), 'bye']
+            self.assertEqual(self.read_all(len, messages), messages)
+            self.assertEqual(self.read_all(byte_length, messages), messages)
+
+    def test_closed_connection(self):
+        reader = protocol.MessageReader(_FakeSocket(b'000010:abc'))
+        self.assertRaises(EOFError, reader.read_message, reader.read_length())
+
+
+class SendBuffersTestCase(unittest.TestCase):
+    def test_partial_sends_are_completed(self):
+        request = _FakeSocket(b'')
+        sent = protocol.send_buffers(request, [b'000005:', b'', b'hello'])
+        self.assertEqual(sent, 12)
+        self.assertEqual(b''.join(request.sent), b'000005:hello')
+
+
+class _Responder(protocol.RequestResponder):
+    def __init__(self, request):
+        self.request = request
+
+
+class _OlderContext(object):
+    # as written before contexts had converters, memory_usage() or close()
+    def __init__(self, isolate_imports):
+        self._context = execution.ExecutionContext(
+            isolate_imports=isolate_imports)
+
+    def __getattr__(self, name):
+        if name in ('converters', 'memory_usage', 'close'):
+            raise AttributeError(name)
+        return getattr(self._context, name)
+
+
+class RequestResponderTestCase(unittest.TestCase):
+    def test_respond_over_socket(self):
+        self.respond_over_socket()
+
+    def test_context_factory_without_newer_args(self):
+        def execution_context(isolate_imports):
+            return execution.ExecutionContext(isolate_imports=isolate_imports)
+        self.respond_over_socket(execution_context=execution_context)
+
+    def test_context_without_newer_attributes(self):
+        self.respond_over_socket(execution_context=_OlderContext)
+
+    def respond_over_socket(self, **kwds):
+        client, server = socket.socketpair()
+        self.addCleanup(client.close)
+        self.addCleanup(server.close)
+        thread = threading.Thread(
+            target=lambda: _Responder(server).respond_to_request(**kwds))
+        thread.start()
+
+        message = protocol.pack([['import_0', 'import', 'a.module']])
+        for text in (message, 'bye'):
+            data = text.encode('utf-8')
+            client.sendall(('%06d:' % len(data)).encode('utf-8') + data)
+        thread.join(5)
+
+        server.shutdown(socket.SHUT_WR)
+        received = b''
+        while True:
+            data = client.recv(1024)
+            if not data:
+                break
+            received += data
+        expected = protocol.pack([['import_0', 'OK']]).encode('utf-8')
+        self.assertEqual(
+            received,
+            b'Slim -- V0.1\n' + ('%06d:' % len(expected)).encode('utf-8')
+            + expected)
+
+
 if __name__ == '__main__':
     unittest.main()